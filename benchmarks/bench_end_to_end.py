@@ -0,0 +1,168 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fakes import FakeFpds, FakeImap, FakeSmtp, request_letter, synthetic_input
+from source.emails import Mail
+from source.excel import Input, Output
+from source.flights import page_flights
+from source.metrics import metrics
+from source.scrapping import Scrapper
+from source.tools import get_output_map, read_config
+
+logger = logging.getLogger(__name__)
+
+
+def measure(function, memory):
+    if memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        result = function()
+    finally:
+        seconds = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1] / 2 ** 20 if memory else None
+        if memory:
+            tracemalloc.stop()
+    return result, seconds, peak
+
+
+def bench_config(args, work_dir, fpds, imap, smtp):
+    config = read_config(logger)
+    config.set('path', 'home_dir', work_dir)  # temp, cache, journal and metrics folders
+    config.set('settings', 'search_HREF', fpds.href)
+    config.set('settings', 'feed_HREF', fpds.feed_href)
+    config.set('settings', 'backend', args.backend)
+    config.set('settings', 'engine', args.engine)
+    config.set('settings', 'output_format', args.format)
+    config.set('settings', 'run_mode', 'batch')
+    config.set('settings', 'mail_ssl', 'no')
+    config.set('settings', 'imap_server', '127.0.0.1')
+    config.set('settings', 'imap_port', str(imap.port))
+    config.set('settings', 'smtp_server', '127.0.0.1')
+    config.set('settings', 'smtp_port', str(smtp.port))
+    config.set('cache', 'enabled', 'no')
+    config.set('journal', 'enabled', 'no')
+    config.set('metrics', 'progress_interval', '3600')
+    return config
+
+
+def stage_throughput(report, scrape_seconds):
+    stages = report['histograms'].get('stage_seconds', {})
+    return {label.split('=')[1]: {'items': stage['count'], 'items_per_second': round(stage['count'] / scrape_seconds, 1),
+                                  'mean_seconds': stage['mean']}
+            for label, stage in stages.items()}
+
+
+def run_scale(args, rows, work_dir, fpds, imap, smtp):
+    config = bench_config(args, work_dir, fpds, imap, smtp)
+    mapping = get_output_map(config, logger)
+    metrics.reset()
+    metrics.configure(config)
+    result = {'rows': rows}
+    input_path = synthetic_input(config, os.path.join(work_dir, 'input_{0}.xlsx'.format(rows)), rows)
+
+    message = Mail(config, temp_dir=os.path.join(work_dir, 'job_{0}'.format(rows)))
+    os.makedirs(message.temp_dir)  # the saved attachment lives there in a real job
+    message.subject = 'benchmark {0}'.format(rows)
+    input_file = Input(config, file_path=input_path)
+    search_names, seconds, peak = measure(lambda: input_file.parse_input(message), args.memory)
+    result['parse_input'] = {'seconds': round(seconds, 3), 'peak_mb': peak, 'search_names': len(search_names)}
+
+    output = Output(config, temp_dir=message.temp_dir)
+    scrapper = Scrapper(config, mapping, output=output)
+    fpds.requests.clear()
+    page_flights(config).clear()  # every step fetches the pages again
+    _, seconds, peak = measure(lambda: scrapper.run(search_names, message), args.memory)
+    forms = output.rows if output.streaming else len(scrapper.forms_df.index)
+    result['scrapper_run'] = {'seconds': round(seconds, 3), 'peak_mb': peak, 'forms': forms,
+                              'forms_per_second': round(forms / seconds, 1), 'requests': dict(fpds.requests),
+                              'stages': stage_throughput(metrics.report(), seconds)}
+
+    if not output.streaming:
+        _, seconds, peak = measure(lambda: output.write(scrapper.forms_df), args.memory)
+        result['output_write'] = {'seconds': round(seconds, 3), 'peak_mb': peak,
+                                  'rows_per_second': round(forms / seconds, 1) if seconds else None}
+
+    # The whole bot: IMAP letter -> input parsing -> scrapping -> output -> SMTP reply
+    import main
+    main.read_config = lambda main_logger: config  # MainClass reads settings/config.cfg, point it to the fakes
+    imap.deliver(request_letter('user@example.com', 'benchmark {0}'.format(rows), [input_path]))
+    letters = len(smtp.letters)
+    page_flights(config).clear()
+    _, seconds, peak = measure(lambda: main.MainClass().batch_execution(), args.memory)
+    replies = smtp.letters[letters:]
+    result['end_to_end'] = {'seconds': round(seconds, 3), 'peak_mb': peak,
+                            'reply': replies[0]['Subject'] if replies else None,
+                            'attachments': sum(1 for part in replies[0].walk() if part.get_filename())
+                            if replies else 0}
+    return result
+
+
+def print_result(result):
+    def peak(step):
+        return '' if step['peak_mb'] is None else '{0:7.1f} MB'.format(step['peak_mb'])
+
+    print('{0} input rows, {1} search names, {2} forms'.format(
+        result['rows'], result['parse_input']['search_names'], result['scrapper_run']['forms']))
+    print('  Input.parse_input  {0:8.3f} s {1}'.format(result['parse_input']['seconds'], peak(result['parse_input'])))
+    run = result['scrapper_run']
+    print('  Scrapper.run       {0:8.3f} s {1}  {2:8.1f} forms/s  requests {3}'.format(
+        run['seconds'], peak(run), run['forms_per_second'], run['requests']))
+    for name, stage in run['stages'].items():
+        print('    {0:<15} {1:6} items {2:8.1f} items/s {3:8.3f} s/item'.format(
+            name, stage['items'], stage['items_per_second'], stage['mean_seconds']))
+    if 'output_write' in result:
+        print('  Output.write       {0:8.3f} s {1}'.format(result['output_write']['seconds'],
+                                                        peak(result['output_write'])))
+    end_to_end = result['end_to_end']
+    print('  end to end         {0:8.3f} s {1}  reply: {2} ({3} attachments)'.format(
+        end_to_end['seconds'], peak(end_to_end), end_to_end['reply'], end_to_end['attachments']))
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description='Offline end-to-end benchmark against local FPDS/IMAP/SMTP stand-ins')
+    parser.add_argument('--scales', default='50,200,1000', help='input rows per run')
+    parser.add_argument('--results', type=int, default=12, help='awards found by each search name')
+    parser.add_argument('--per-page', type=int, default=30)
+    parser.add_argument('--latency', type=float, default=0.02, help='mean FPDS response time, seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of 429 responses')
+    parser.add_argument('--smtp-latency', type=float, default=0.0)
+    parser.add_argument('--engine', default='asyncio', choices=['asyncio', 'thread'])
+    parser.add_argument('--backend', default='html', choices=['html', 'atom'])
+    parser.add_argument('--format', default='xlsx', choices=['xlsx', 'xlsx_stream', 'csv', 'parquet'])
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help='skip tracemalloc, it slows allocation heavy steps down')
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    logging.basicConfig(level=logging.CRITICAL)
+    fpds = FakeFpds(results=args.results, per_page=args.per_page, latency=args.latency,
+                    error_rate=args.error_rate).start()
+    imap = FakeImap().start()
+    smtp = FakeSmtp(latency=args.smtp_latency).start()
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            for rows in [int(rows) for rows in args.scales.split(',')]:
+                results.append(run_scale(args, rows, work_dir, fpds, imap, smtp))
+                print_result(results[-1])
+    finally:
+        fpds.stop()
+        imap.stop()
+        smtp.stop()
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as writer:
+            json.dump(results, writer, indent=2)
+
+
+if __name__ == '__main__':
+    main_benchmark()
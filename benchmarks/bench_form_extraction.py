@@ -0,0 +1,87 @@
+import argparse
+import logging
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bs4 import BeautifulSoup
+from source.extractor import FormExtractor
+from source.parsers import ParserPool
+from source.tools import get_output_map, read_config
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def soup_find_extract(page, form_tags):  # previous Scrapper._scrape_form: one soup.find per mapped id
+    soup = BeautifulSoup(page, features='lxml')
+    result = dict.fromkeys(form_tags)
+    for k, v in form_tags.items():
+        tag = soup.find(id=k)
+        if tag:
+            if v == 'input':
+                result[k] = tag.attrs.get('value')
+            elif v == 'checkbox':
+                result[k] = bool(tag.attrs.get('checked'))
+            elif v == 'td' or v == 'text':
+                result[k] = tag.text
+            elif v == 'select':
+                option = tag.find_next('option', {'selected': 'true'})
+                if option:
+                    result[k] = option.text
+    return result
+
+
+def pool_throughput(config, form_tags, page, workers, number):
+    # Pages submitted at once like the form stage workers do; spawning the processes is not timed
+    config.set('parsers', 'workers', str(workers))
+    pool = ParserPool(config, form_tags).open()
+    try:
+        pool.extract(page)
+        started = time.perf_counter()
+        futures = [pool.submit(page) for _ in range(number)]
+        results = [future.result() for future in futures]
+        seconds = (time.perf_counter() - started) / number
+    finally:
+        pool.close()
+    if results[0] != FormExtractor(form_tags).extract(page):
+        raise SystemExit('Parser pool result differs from FormExtractor')
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Award form field extraction microbenchmark')
+    parser.add_argument('--number', type=int, default=200)
+    parser.add_argument('--fixture', default=os.path.join(FIXTURES, 'fpds_award_form.html'))
+    parser.add_argument('--workers', default='', help='parser pool sizes to measure, e.g. 1,2,4,8')
+    args = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    logger = logging.getLogger(__name__)
+    config = read_config(logger)
+    mapping = get_output_map(config, logger)
+    form_tags = {value[0]: value[1] for value in mapping.values() if value[0]}
+    with open(args.fixture, encoding='utf-8') as reader:
+        page = reader.read()
+
+    extractor = FormExtractor(form_tags)
+    expected = soup_find_extract(page, form_tags)
+    extracted = extractor.extract(page)
+    if extracted != expected:
+        diff = {k: (expected[k], extracted[k]) for k in expected if expected[k] != extracted[k]}
+        raise SystemExit('Extractors disagree: {0}'.format(diff))
+
+    for name, function in [('soup.find per field', lambda: soup_find_extract(page, form_tags)),
+                           ('FormExtractor', lambda: extractor.extract(page))]:
+        seconds = min(timeit.repeat(function, number=args.number, repeat=3)) / args.number
+        print('{0:<22} {1:8.3f} ms/form {2:8.1f} forms/s'.format(name, seconds * 1000, 1 / seconds))
+    for workers in [int(workers) for workers in args.workers.split(',') if workers]:
+        seconds = pool_throughput(config, form_tags, page, workers, args.number * workers)
+        print('{0:<22} {1:8.3f} ms/form {2:8.1f} forms/s'.format(
+            'ParserPool({0})'.format(workers), seconds * 1000, 1 / seconds))
+
+
+if __name__ == '__main__':
+    main()
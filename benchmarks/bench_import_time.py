@@ -0,0 +1,60 @@
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Only the scrapping job needs them, `import main` must not bring them in
+JOB_MODULES = ('pandas', 'numpy', 'aiohttp', 'requests', 'bs4', 'lxml', 'openpyxl', 'xlrd')
+LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def import_times(module):
+    # Cumulative import time of every module in a fresh interpreter, microseconds
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import {0}'.format(module)], cwd=ROOT,
+                            stderr=subprocess.PIPE, universal_newlines=True, check=True).stderr
+    times = {}
+    for line in output.splitlines():
+        match = LINE.match(line)
+        if match:
+            times[match.group(4)] = int(match.group(2))
+    return times
+
+
+def loaded_modules(module):
+    code = 'import sys, {0}; print(" ".join(sys.modules))'.format(module)
+    output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, stdout=subprocess.PIPE,
+                            universal_newlines=True, check=True).stdout
+    return set(output.split())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cold start import time of the entry point')
+    parser.add_argument('--module', default='main')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10, help='slowest imported modules to show')
+    parser.add_argument('--max-ms', type=float, default=0, help='fail if the best import time is over it')
+    args = parser.parse_args()
+
+    runs = [import_times(args.module) for _ in range(args.repeat)]
+    best = min(runs, key=lambda times: times.get(args.module, 0))
+    total = best.get(args.module, 0) / 1000
+    print('import {0:<18} {1:8.1f} ms (best of {2})'.format(args.module, total, args.repeat))
+    for name, micros in sorted(best.items(), key=lambda item: -item[1])[1:args.top + 1]:
+        print('  {0:<28} {1:8.1f} ms'.format(name, micros / 1000))
+
+    failed = False
+    heavy = sorted(module for module in JOB_MODULES if module in loaded_modules(args.module))
+    if heavy:
+        print('job modules imported at start: {0}'.format(', '.join(heavy)))
+        failed = True
+    if args.max_ms and total > args.max_ms:
+        print('import time {0:.1f} ms is over {1:.1f} ms'.format(total, args.max_ms))
+        failed = True
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
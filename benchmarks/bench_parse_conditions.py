@@ -0,0 +1,95 @@
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+from re import sub
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+from source.excel import Input
+from source.tools import read_config
+
+ACCOUNTS = ['Commerce', 'USFEDHHSCDC', 'USFEDHHSFDA', 'USFEDHHSNIH', 'USFEDHHSOS', 'USFEDHHSCMS', 'IRS', 'DHS', 'Army']
+VEHICLES = ['BPA', 'BOA', 'Indefinite Delivery Contract', 'Standalone', 'DO/TO/WO/Call/PO', 'Cooperative Agreement',
+            'Other', '']
+
+
+def synthetic_rows(config, count, seed=0):
+    random.seed(seed)
+    keys = list(config['input_cols'].keys())
+    rows = []
+    for i in range(count):
+        contract = random.choice(['GS-35F-{0:04d}'.format(i % 5000), 'HHSN{0}'.format(i), 'N/A'])
+        values = {
+            'project': 'P{0}'.format(i),
+            'account': random.choice(ACCOUNTS),
+            'gsa_num': random.choice(['N/A', 'GS00Q14OADU{0}'.format(i % 97), contract, '']),
+            'contract_num': contract,
+            'task_num': random.choice(['', 'n/a', 'DOC-{0}'.format(i), 'HHSD {0}'.format(i), 'T{0}'.format(i)]),
+            'log_name': 'Long name {0}'.format(i),
+            'prime': random.choice(['Prime', 'Sub']),
+            'vehicle_type': random.choice(VEHICLES),
+            'search_name': 'Preset {0}'.format(i) if random.random() < 0.05 else '',
+        }
+        rows.append([values[k] for k in keys] + ['extra {0}'.format(i)])
+        if random.random() < 0.01:
+            rows.append([''] * (len(keys) + 1))
+    return pd.DataFrame(rows)
+
+
+def legacy_split_rows(config, columns_dict, df_without_header):  # previous Input.parse_input loop
+    process = []
+    non_process = []
+    for row_idx, input_row in df_without_header.iterrows():
+        row = input_row.copy()
+        if all(val.strip() == '' for val in row):
+            continue
+        for col_idx in [columns_dict['contract_num'], columns_dict['contract_num']]:
+            row[col_idx] = sub('\\W', '', row[col_idx])
+        row_conv = [sub("\\s|\\n", "", str(val).lower().strip()) for val in row]
+        if not pd.isna(row[columns_dict['search_name']]) and row[columns_dict['search_name']].strip() != '':
+            process.append(tuple(row.values))
+            continue
+        for condition in config.options('parse_conditions'):
+            if eval(condition, {'r_c': row_conv, 'col': columns_dict}):
+                row[columns_dict['search_name']] = eval(config.get('parse_conditions', condition),
+                                                        {'r': row, 'col': columns_dict})
+                process.append(tuple(row.values))
+                break
+        else:
+            non_process.append(tuple(row.values))
+    return process, non_process
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Input parse_conditions benchmark')
+    parser.add_argument('--sizes', default='1000,10000,100000')
+    parser.add_argument('--legacy-limit', type=int, default=10000, help='skip the row-by-row loop above this size')
+    args = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    config = read_config(logging.getLogger(__name__))
+    input_file = Input(config, file_path=None)
+    input_file.columns_dict = {k: idx for idx, k in enumerate(config['input_cols'].keys())}
+
+    for size in [int(size) for size in args.sizes.split(',')]:
+        df = synthetic_rows(config, size)
+        started = time.perf_counter()
+        process, non_process = input_file._split_rows(df)
+        vector_seconds = time.perf_counter() - started
+        line = '{0:>7} rows  compiled {1:8.3f} s'.format(size, vector_seconds)
+        if size <= args.legacy_limit:
+            started = time.perf_counter()
+            expected = legacy_split_rows(config, input_file.columns_dict, df)
+            legacy_seconds = time.perf_counter() - started
+            if expected != (process, non_process):
+                raise SystemExit('Results differ from the row-by-row loop for {0} rows'.format(size))
+            line += '  row-by-row {0:8.3f} s  x{1:.1f}'.format(legacy_seconds, legacy_seconds / vector_seconds)
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+import argparse
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fakes import FakeFpds
+from source.emails import Mail
+from source.metrics import metrics
+from source.scrapping import Scrapper
+from source.tools import get_output_map, read_config
+
+logger = logging.getLogger(__name__)
+
+
+def queue_config(args, work_dir, fpds):
+    config = read_config(logger)
+    config.set('path', 'home_dir', work_dir)
+    config.set('settings', 'search_HREF', fpds.href)
+    config.set('settings', 'feed_HREF', fpds.feed_href)
+    config.set('settings', 'backend', args.backend)
+    config.set('settings', 'engine', 'thread')
+    config.set('settings', 'pool', str(args.worker_threads))
+    config.set('cache', 'enabled', 'no')
+    config.set('journal', 'enabled', 'no')
+    config.set('metrics', 'enabled', 'no')
+    config.set('queue', 'poll_interval', '0.05')
+    config.set('queue', 'stall_timeout', '60')
+    config.set('queue', 'worker_threads', str(args.worker_threads))
+    return config
+
+
+def start_workers(config, work_dir, count):
+    # worker.py reads settings/ of its working directory, as on another node with its own copy
+    settings = os.path.join(work_dir, 'settings')
+    if not os.path.exists(settings):
+        shutil.copytree(os.path.join(ROOT, 'settings'), settings)
+    with open(os.path.join(settings, 'config.cfg'), 'w') as writer:
+        config.write(writer)
+    return [subprocess.Popen([sys.executable, os.path.join(ROOT, 'worker.py')], cwd=work_dir) for _ in range(count)]
+
+
+def stop_workers(workers):
+    for worker in workers:
+        worker.terminate()
+    for worker in workers:
+        worker.wait(60)
+
+
+def scrape(config, mapping, work_dir, search_names):
+    metrics.reset()
+    message = Mail(config, temp_dir=os.path.join(work_dir, 'job'))
+    scrapper = Scrapper(config, mapping)
+    started = time.perf_counter()
+    scrapper.run(search_names, message)
+    seconds = time.perf_counter() - started
+    rows = sorted(tuple(str(value) for value in row) for row in scrapper.forms_df.itertuples(index=False))
+    return seconds, rows, scrapper.success_names
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Scrapping through the work queue by local worker.py processes')
+    parser.add_argument('--names', type=int, default=40, help='search names of the run')
+    parser.add_argument('--results', type=int, default=20, help='awards found by each search name')
+    parser.add_argument('--per-page', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.05, help='mean FPDS response time, seconds')
+    parser.add_argument('--backend', default='html', choices=['html', 'atom'])
+    parser.add_argument('--workers', default='1,2,4', help='worker process counts to measure')
+    parser.add_argument('--worker-threads', type=int, default=4)
+    args = parser.parse_args()
+
+    os.chdir(ROOT)
+    logging.basicConfig(level=logging.CRITICAL)
+    fpds = FakeFpds(results=args.results, per_page=args.per_page, latency=args.latency).start()
+    search_names = ['Vendor {0}'.format(idx) for idx in range(args.names)] + ['']
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            config = queue_config(args, work_dir, fpds)
+            mapping = get_output_map(config, logger)
+            seconds, expected, success_names = scrape(config, mapping, work_dir, search_names)
+            print('{0:<22} {1:8.3f} s {2:8.1f} forms/s'.format('local threads', seconds, len(expected) / seconds))
+            config.set('queue', 'enabled', 'yes')
+            for count in [int(count) for count in args.workers.split(',') if count]:
+                workers = start_workers(config, work_dir, count)
+                try:
+                    scrape(config, mapping, work_dir, search_names[:1])  # waits for the workers to start
+                    fpds.requests.clear()
+                    seconds, rows, names = scrape(config, mapping, work_dir, search_names)
+                finally:
+                    stop_workers(workers)
+                if rows != expected or names != success_names:
+                    raise SystemExit('Work queue run with {0} workers differs from the local run'.format(count))
+                print('{0:<22} {1:8.3f} s {2:8.1f} forms/s  requests {3}'.format(
+                    '{0} workers x {1} threads'.format(count, args.worker_threads), seconds, len(rows) / seconds,
+                    dict(fpds.requests)))
+    finally:
+        fpds.stop()
+
+
+if __name__ == '__main__':
+    main()
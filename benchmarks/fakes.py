@@ -0,0 +1,354 @@
+import email
+import os
+import random
+import re
+import select
+import socketserver
+import threading
+import time
+from collections import Counter
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.utils import collapse_rfc2231_value, encode_rfc2231, make_msgid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+import pandas as pd
+from bench_parse_conditions import synthetic_rows
+from openpyxl import Workbook
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+class _Server:
+
+    def start(self):
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+
+class FakeFpds(_Server):
+    # ezsearch/fpdsportal stand-in: search pages with results_heading and View links, pagination by start=,
+    # award forms, and the ATOM feed (ezsearch/FEEDS/ATOM, feed_page entries per page) made of the recorded
+    # entry. latency - mean seconds per response, error_rate - share of 429 answers with Retry-After
+
+    def __init__(self, results=40, per_page=30, latency=0.0, error_rate=0.0, form_page=None, port=0, seed=0,
+                 modified=None, feed_page=10):
+        self.results = results  # results per search name: int or function of the name
+        self.modified = modified  # last modified date in the result row: function of (name, index) or None
+        self.per_page = per_page
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        if form_page is None:
+            with open(os.path.join(FIXTURES, 'fpds_award_form.html'), encoding='utf-8') as reader:
+                form_page = reader.read()
+        self.form_page = form_page.encode('utf-8')
+        self.feed_page = feed_page
+        with open(os.path.join(FIXTURES, 'fpds_atom_feed.xml'), encoding='utf-8') as reader:
+            feed = reader.read()
+        self.feed_head = feed[:feed.index('<entry>')]
+        self.feed_entry = feed[feed.index('<entry>'):feed.rindex('</entry>') + len('</entry>')]
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                fake.handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+
+    @property
+    def href(self):
+        return 'http://127.0.0.1:{0}/ezsearch/fpdsportal'.format(self.port)
+
+    def result_count(self, name):
+        return self.results(name) if callable(self.results) else self.results
+
+    def search_page(self, name, start):
+        count = self.result_count(name)
+        piid = re.sub('\\W', '', name).upper() or 'EMPTY'
+        rows = ''.join("<table class='resultbox1'><tr><td>{0}</td><td>Last Modified Date: {3}</td><td>"
+                       "<a title='View' href=\"javascript:viewLink('/ezsearch/fpdsportal?s=FPDS&amp;"
+                       "templateName=1.5&amp;indexName=awardfull&amp;PIID={1}&amp;modNumber={2}')\">View</a>"
+                       "</td></tr></table>".format(name, piid, idx,
+                                                   self.modified(name, idx) if self.modified else '01/02/2024')
+                       for idx in range(start, min(count, start + self.per_page)))
+        return ('<html><body><form name="search_awardfull"></form><span class="results_heading">Results</span> '
+                '<b>1</b> - <b>{0}</b> of <b>{1}</b>{2}</body></html>').format(
+            self.per_page, count, rows)
+
+    @property
+    def feed_href(self):
+        return 'http://127.0.0.1:{0}/ezsearch/FEEDS/ATOM?FEEDNAME=PUBLIC'.format(self.port)
+
+    def feed(self, name, start):
+        count = self.result_count(name)
+        piid = re.sub('\\W', '', name).upper() or 'EMPTY'
+        head = self.feed_head
+        if start + self.feed_page < count:
+            head += '<link rel="next" type="application/atom+xml" href="{0}&amp;{1}"/>\n'.format(
+                self.feed_href, urlencode({'q': name, 'start': start + self.feed_page}).replace('&', '&amp;'))
+        entries = ''.join(self.feed_entry.replace('47QFCA19F0055', piid).replace('P00004', str(idx))
+                          for idx in range(start, min(count, start + self.feed_page)))
+        return head + entries + '\n</feed>\n'
+
+    def handle(self, request):
+        with self._lock:
+            delay = self._random.expovariate(1 / self.latency) if self.latency else 0
+            throttle = self._random.random() < self.error_rate
+        time.sleep(delay)
+        query = parse_qs(urlsplit(request.path).query)
+        if throttle:
+            self.requests['throttled'] += 1
+            request.send_response(429)
+            request.send_header('Retry-After', '1')
+            request.send_header('Content-Length', '0')
+            request.end_headers()
+            return
+        content_type = 'text/html; charset=UTF-8'
+        if urlsplit(request.path).path.endswith('/ATOM'):
+            self.requests['feed'] += 1
+            content_type = 'application/atom+xml; charset=UTF-8'
+            body = self.feed(query.get('q', [''])[0], int(query.get('start', ['0'])[0])).encode('utf-8')
+        elif 'PIID' in query:
+            self.requests['form'] += 1
+            body = self.form_page
+        elif 'q' in query:
+            self.requests['pagination' if 'start' in query else 'search'] += 1
+            body = self.search_page(query['q'][0], int(query.get('start', ['0'])[0])).encode('utf-8')
+        else:
+            self.requests['start'] += 1
+            body = b'<html><body><form name="search_awardfull"></form></body></html>'
+        request.send_response(200)
+        request.send_header('Content-Type', content_type)
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+
+def _quote(value):
+    return 'NIL' if value is None else '"{0}"'.format(value.replace('\\', '\\\\').replace('"', '\\"'))
+
+
+def _param_list(pairs):
+    return '({0})'.format(' '.join('{0} {1}'.format(_quote(k), _quote(v)) for k, v in pairs)) if pairs else 'NIL'
+
+
+def body_structure(part):
+    if part.is_multipart():
+        return '({0} {1})'.format(''.join(body_structure(child) for child in part.get_payload()),
+                                  _quote(part.get_content_subtype()))
+    raw = part.get_payload().encode('ascii', 'replace')
+    params = part.get_params()[1:] if part.get_params() else []
+    disposition = 'NIL'
+    if part.get('Content-Disposition'):
+        disposition_params = [(k + '*', encode_rfc2231(collapse_rfc2231_value(v), v[0], v[1]))
+                              if isinstance(v, tuple) else (k, v)
+                              for k, v in part.get_params(header='content-disposition')[1:]]
+        disposition = '({0} {1})'.format(_quote(part.get_content_disposition()), _param_list(disposition_params))
+    fields = [_quote(part.get_content_maintype()), _quote(part.get_content_subtype()), _param_list(params), 'NIL',
+              'NIL', _quote(part.get('Content-Transfer-Encoding', '7bit')), str(len(raw))]
+    if part.get_content_maintype() == 'text':
+        fields.append(str(raw.count(b'\n')))
+    fields.extend(['NIL', disposition, 'NIL', 'NIL'])
+    return '({0})'.format(' '.join(fields))
+
+
+def _section(message, number):
+    part = message
+    for idx in number.split('.'):
+        part = part.get_payload()[int(idx) - 1] if part.is_multipart() else part
+    return part.get_payload().encode('ascii', 'replace')
+
+
+class FakeImap(_Server):
+    # IMAP4rev1 subset used by Mailbox: LOGIN, SELECT, SEARCH UNSEEN, FETCH of BODYSTRUCTURE, header fields and
+    # partial BODY.PEEK sections, STORE +FLAGS, NOOP and IDLE (idle=False hides it from CAPABILITY)
+
+    def __init__(self, idle=True, port=0):
+        self.idle = idle
+        self.mails = []  # [raw message, seen]
+        self.commands = Counter()
+        fake = self
+
+        class Handler(socketserver.StreamRequestHandler):
+
+            def handle(self):
+                fake.session(self)
+
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', port), Handler)
+
+    def deliver(self, raw_message):
+        self.mails.append([raw_message, False])
+
+    def session(self, handler):
+        def write(data):
+            handler.wfile.write(data if isinstance(data, bytes) else data.encode('utf-8'))
+            handler.wfile.flush()
+
+        write('* OK fake IMAP ready\r\n')
+        reported = len(self.mails)  # EXISTS count the client was told
+        while True:
+            line = handler.rfile.readline()
+            if not line:
+                return
+            tag, command, *args = line.decode('utf-8').strip().split(' ', 2)
+            command = command.upper()
+            args = args[0] if args else ''
+            self.commands[command] += 1
+            done = '{0} OK {1} completed\r\n'.format(tag, command).encode('utf-8')
+            if command == 'CAPABILITY':
+                write('* CAPABILITY IMAP4rev1{0}\r\n'.format(' IDLE' if self.idle else ''))
+                write(done)
+            elif command in ('LOGIN', 'NOOP', 'CLOSE'):
+                write(done)
+            elif command == 'SELECT':
+                reported = len(self.mails)
+                write('* {0} EXISTS\r\n'.format(reported))
+                write(done)
+            elif command == 'SEARCH':
+                write('* SEARCH {0}\r\n'.format(' '.join(str(idx + 1) for idx, (raw, seen) in enumerate(self.mails)
+                                                         if not seen)))
+                write(done)
+            elif command == 'STORE':
+                self.mails[int(args.split()[0]) - 1][1] = True
+                write(done)
+            elif command == 'FETCH':
+                number, items = args.split(' ', 1)
+                write(self.fetch(int(number), items))
+                write(done)
+            elif command == 'IDLE':
+                count = len(self.mails)
+                if count != reported:  # letters which came before IDLE: reported with the continuation at once
+                    write('* {0} RECENT\r\n+ idling\r\n* {0} EXISTS\r\n'.format(count))
+                else:
+                    write('+ idling\r\n')
+                while not select.select([handler.rfile], [], [], 0.1)[0]:
+                    if len(self.mails) != count:
+                        count = len(self.mails)
+                        write('* {0} EXISTS\r\n'.format(count))
+                reported = count
+                handler.rfile.readline()  # DONE
+                write(done)
+            elif command == 'LOGOUT':
+                write('* BYE\r\n')
+                write(done)
+                return
+            else:
+                write('{0} BAD unknown command\r\n'.format(tag))
+
+    def fetch(self, number, items):
+        raw, seen = self.mails[number - 1]
+        message = email.message_from_bytes(raw)
+        if 'BODYSTRUCTURE' in items:
+            header = 'From: {0}\r\nSubject: {1}\r\nMessage-ID: {2}\r\n\r\n'.format(
+                message['from'], message['subject'], message['message-id']).encode('utf-8')
+            return '* {0} FETCH (BODYSTRUCTURE {1} BODY[HEADER.FIELDS (FROM SUBJECT MESSAGE-ID)] {{{2}}}\r\n'.format(
+                number, body_structure(message), len(header)).encode('utf-8') + header + b')\r\n'
+        section = re.search('BODY\\.PEEK\\[([\\d.]+)\\]<(\\d+)\\.(\\d+)>', items)
+        start, size = int(section.group(2)), int(section.group(3))
+        data = _section(message, section.group(1))[start:start + size]
+        return '* {0} FETCH (BODY[{1}]<{2}> {{{3}}}\r\n'.format(
+            number, section.group(1), start, len(data)).encode('utf-8') + data + b')\r\n'
+
+
+class FakeSmtp(_Server):
+    # Accepts every letter; latency - seconds for login and for each letter
+
+    def __init__(self, latency=0.0, port=0):
+        self.latency = latency
+        self.connections = 0
+        self.logins = 0
+        self.letters = []
+        fake = self
+
+        class Handler(socketserver.StreamRequestHandler):
+
+            def handle(self):
+                fake.session(self)
+
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', port), Handler)
+
+    def session(self, handler):
+        def write(text):
+            handler.wfile.write(text.encode('utf-8'))
+            handler.wfile.flush()
+
+        self.connections += 1
+        write('220 fake ESMTP\r\n')
+        while True:
+            line = handler.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8').strip().split(' ')[0].upper()
+            if command in ('EHLO', 'HELO'):
+                write('250-fake\r\n250 AUTH PLAIN LOGIN\r\n')
+            elif command == 'AUTH':
+                time.sleep(self.latency)
+                self.logins += 1
+                write('235 Authentication successful\r\n')
+            elif command in ('MAIL', 'RCPT', 'RSET', 'NOOP'):
+                write('250 OK\r\n')
+            elif command == 'DATA':
+                write('354 End data with <CR><LF>.<CR><LF>\r\n')
+                data = []
+                for data_line in iter(handler.rfile.readline, b''):
+                    if data_line == b'.\r\n':
+                        break
+                    data.append(data_line)
+                time.sleep(self.latency)
+                self.letters.append(email.message_from_bytes(b''.join(data)))
+                write('250 OK queued\r\n')
+            elif command == 'QUIT':
+                write('221 Bye\r\n')
+                return
+            else:
+                write('502 Command not implemented\r\n')
+
+
+def synthetic_input(config, file_path, rows, seed=0):
+    # Input workbook the way users send it: title, empty row, template headers, then data rows
+    keys = list(config['input_cols'].keys())
+    header = [config.get('input_cols', key) for key in keys] + ['Comment']
+    data = synthetic_rows(config, rows, seed=seed).values.tolist()
+    sheet_rows = [['FPDS bot input'], [], header] + data
+    if file_path.endswith('.xlsx'):
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet(config.get('settings', 'input_sheet'))
+        for row in sheet_rows:
+            sheet.append(row)
+        workbook.save(file_path)
+    else:
+        pd.DataFrame(sheet_rows).to_excel(file_path, header=False, index=False,
+                                          sheet_name=config.get('settings', 'input_sheet'))
+    return file_path
+
+
+def request_letter(sender, subject, attachments=()):
+    msg = MIMEMultipart()
+    msg['From'] = sender
+    msg['Subject'] = subject
+    msg['Message-ID'] = make_msgid()
+    msg.attach(MIMEText('Please process the attached file.'))
+    for file_path in attachments:
+        with open(file_path, 'rb') as reader:
+            part = MIMEApplication(reader.read())
+        part.add_header('Content-Disposition', 'attachment', filename=os.path.basename(file_path))
+        msg.attach(part)
+    return msg.as_bytes()
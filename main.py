@@ -1,63 +1,196 @@
 import logging.config
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from shutil import rmtree
 
-from source.scrapping import Scrapper
-from source.emails import Mail
+from source.emails import Mail, Mailbox, Outbox, smtp_pool
+from source.limiter import AdaptiveLimiter
+from source.metrics import metrics
 from source.tools import delete_temp, make_loger, get_output_map, read_config
-from source.excel import Input, Output
+
+logger = logging.getLogger('mainFPDS')
+
+
+# source.excel and source.scrapping bring pandas, openpyxl, bs4, lxml, requests and aiohttp (most of the start
+# time), most runs find no letters and never need them: they are imported by the first job, or in background
+# as soon as the mailbox has unread letters, while the attachments are downloaded
+def warm_up():
+    threading.Thread(target=_import_job_modules, name='warm_up', daemon=True).start()
+
+
+def _import_job_modules():
+    import source.excel
+    import source.scrapping
 
 
 class MainClass:
 
     def __init__(self):
         self.config = read_config(logger)
-        self.output_columns_map = get_output_map(self.config, logger)
+        get_output_map(self.config, logger)  # a broken mapping stops the start, not the first job
+        self.limiter = AdaptiveLimiter(self.config)  # one FPDS concurrency budget for all jobs
+        metrics.configure(self.config)
         delete_temp(self.config)
 
+    @property
+    def output_columns_map(self):
+        return get_output_map(self.config, logger)  # re-read only when the file is changed
+
+    def __scrape(self, message, input, search_names):
+        from source.excel import Output
+        from source.scrapping import Scrapper
+        if len(search_names) > 0:
+            output = Output(self.config, temp_dir=message.temp_dir)
+            scrapper = Scrapper(self.config, self.output_columns_map, limiter=self.limiter, output=output)
+            scrapper.run(search_names, message)
+            input.add_status_column(scrapper.success_names)
+            with metrics.phase('input_save'):
+                input.save()
+            if not scrapper.forms_df.empty:
+                with metrics.phase('output_write'):
+                    output.write(scrapper.forms_df)
+            if output.rows > 0:
+                with metrics.phase('reply'):
+                    message.success_reply(output_file=output.path, no_processed=input.has_non_processed)
+                return
+        else:
+            with metrics.phase('input_save'):
+                input.save()
+        with metrics.phase('reply'):
+            message.success_reply(output_file=None, no_processed=input.has_non_processed)
+
+    def __parse_input(self, message):
+        from source.excel import Input
+        with metrics.phase('input_parse'):
+            input = Input(self.config, file_path=message.saved_attachment)
+            return input, input.parse_input(message)
+
     def __bot_process(self):
         while True:
             try:
                 message = Mail(self.config)
-                message.save_earlier_mail_attachment()
-                input = Input(self.config, file_path=message.saved_attachment)
-                search_names = input.parse_input(message)
+                with metrics.phase('mail_fetch'):
+                    message.save_earlier_mail_attachment(on_letters=warm_up)
+                input, search_names = self.__parse_input(message)
                 break
             except Exception as exception:
                 delete_temp(self.config)
                 if '*Failed_message' not in exception.args:
                     raise exception
+        self.__scrape(message, input, search_names)
 
-        if len(search_names) > 0:
-            scrapper = Scrapper(self.config, self.output_columns_map)
-            scrapper.run(search_names, message)
-            input.add_status_column(scrapper.success_names)
-            if not scrapper.forms_df.empty:
-                output = Output(self.config)
-                output.write(scrapper.forms_df)
-                message.success_reply(output_file=output.path, no_processed=input.has_non_processed)
-                return
-        message.success_reply(output_file=None, no_processed=input.has_non_processed)
+    def __handle_error(self, ex):
+        if '*Handled_error' not in ex.args:
+            try:
+                logger.error(self.config.get('error', 'unexpected'), exc_info=True)
+                unexpected_message = Mail(self.config)
+                unexpected_message.send_fail_to_admin(letter=4)
+            except Exception:
+                logger.error(self.config.get('error', 'unexpected'), exc_info=True)
+
+    def __job(self, message):
+        try:
+            with metrics.phase('job'):
+                try:
+                    input, search_names = self.__parse_input(message)
+                except Exception as exception:
+                    if '*Failed_message' not in exception.args:
+                        raise exception
+                    return
+                self.__scrape(message, input, search_names)
+        except Exception as ex:
+            self.__handle_error(ex)
+        finally:
+            rmtree(message.temp_dir, ignore_errors=True)
 
     def execution(self):
         try:
             self.__bot_process()
         except Exception as ex:
-            if '*Handled_error' not in ex.args:
+            self.__handle_error(ex)
+        smtp_pool(self.config).close()
+        metrics.write()
+        delete_temp(self.config)
+
+    def __start_outbox(self):
+        Mail.outbox = Outbox(self.config)
+
+    @staticmethod
+    def __stop_outbox():
+        Mail.outbox.close()
+        Mail.outbox = None
+
+    def batch_execution(self):
+        self.__start_outbox()
+        try:
+            with metrics.phase('mail_fetch'):
+                messages = Mailbox(self.config).fetch_unread_mails(self.config.get('path', 'temp'), on_letters=warm_up)
+            with ThreadPoolExecutor(self.config.getint('settings', 'jobs_workers')) as executor:
+                list(executor.map(self.__job, messages))
+        except Exception as ex:
+            self.__handle_error(ex)
+        self.__stop_outbox()
+        metrics.write()
+        delete_temp(self.config)
+
+    def daemon_execution(self):
+        # Resident mode: one IMAP connection waits for letters with IDLE (NOOP polling if not supported),
+        # reconnects with backoff and on SIGTERM stops taking letters and finishes the started jobs
+        stopping = threading.Event()
+        for signal_number in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signal_number, lambda signum, frame: stopping.set())
+        logger.info(self.config.get('info', 'daemon_started'))
+        temp_root = self.config.get('path', 'temp')
+        reconnect_min = self.config.getfloat('daemon', 'reconnect_min')
+        reconnect_max = self.config.getfloat('daemon', 'reconnect_max')
+        delay = reconnect_min
+        admin_notified = False
+        mailbox = Mailbox(self.config)
+        notifier = Mail(self.config)
+        self.__start_outbox()
+        with ThreadPoolExecutor(self.config.getint('settings', 'jobs_workers')) as executor:
+            while not stopping.is_set():
                 try:
-                    logger.error(self.config.get('error', 'unexpected'), exc_info=True)
-                    unexpected_message = Mail(self.config)
-                    unexpected_message.send_fail_to_admin(letter=4)
-                except Exception:
-                    logger.error(self.config.get('error', 'unexpected'), exc_info=True)
+                    mailbox.open(None if admin_notified else notifier)
+                    delay = reconnect_min
+                    admin_notified = False
+                    while not stopping.is_set():
+                        emails_indexes = mailbox.unread()
+                        if emails_indexes:
+                            logger.info(self.config.get('info', 'got_letters').format(len(emails_indexes)))
+                            warm_up()
+                        with metrics.phase('mail_fetch'):
+                            messages = mailbox.fetch_mails(emails_indexes, temp_root, notifier)
+                        for message in messages:
+                            executor.submit(self.__job, message)
+                        metrics.write()  # cumulative since the daemon start
+                        mailbox.wait(stopping)
+                except Exception as exception:
+                    admin_notified = admin_notified or '*Handled_error' in exception.args
+                    logger.warning(self.config.get('warning', 'imap_reconnect').format(exception, delay))
+                    stopping.wait(delay)
+                    delay = min(delay * 2, reconnect_max)
+                finally:
+                    mailbox.close()
+            logger.info(self.config.get('info', 'daemon_stopping'))
+        self.__stop_outbox()
+        metrics.write()
         delete_temp(self.config)
 
 
 if __name__ == "__main__":
     make_loger()
-    logger = logging.getLogger('mainFPDS')
     logger.info('FPDS bot execution started')
     try:
         main = MainClass()
-        main.execution()
+        run_mode = main.config.get('settings', 'run_mode', fallback='single')
+        if run_mode == 'daemon':
+            main.daemon_execution()
+        elif run_mode == 'batch':
+            main.batch_execution()
+        else:
+            main.execution()
     except Exception:
         pass
     logger.info('FPDS bot execution ended.')
@@ -0,0 +1,86 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import parse_qsl, urlsplit
+from source.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class AwardStore:
+    # Incremental mode: fields of every award seen before, keyed by the award identity from the View href
+    # (PIID, modNumber, ...) and checked against the hash of its search result row. The result row shows the
+    # signed and last modified dates, so an unchanged row means the stored fields are still right
+
+    def __init__(self, config):
+        self.config = config
+        self.path = config.get('path', 'awards')
+        self.enabled = config.getboolean('incremental', 'enabled', fallback=False)
+        self.key_params = [name.strip() for name in
+                           config.get('incremental', 'key_params', fallback='PIID,modNumber').split(',')]
+        self.retention = config.getfloat('incremental', 'retention_days', fallback=90) * 86400
+        self.unchanged = 0
+        self.changed = 0
+        self.new = 0
+        self._connect = None
+        self._lock = threading.Lock()
+
+    def open(self):
+        if not self.enabled:
+            return self
+        if not os.path.exists(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+        self._connect = sqlite3.connect(self.path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._connect.execute('PRAGMA journal_mode=WAL')
+        self._connect.execute('PRAGMA synchronous=NORMAL')
+        self._connect.execute('CREATE TABLE IF NOT EXISTS awards '
+                              '(award TEXT PRIMARY KEY, meta TEXT, fields TEXT, stored REAL, seen REAL)')
+        self._connect.execute('CREATE INDEX IF NOT EXISTS awards_seen ON awards (seen)')
+        return self
+
+    def award_key(self, href):
+        query = dict(parse_qsl(urlsplit(href).query))
+        if not any(query.get(name) for name in self.key_params):
+            return href  # no identity parameters: such awards must not share one key
+        return '/'.join(query.get(name, '') for name in self.key_params)
+
+    def get(self, href, meta):
+        if self._connect is None:
+            return None
+        award = self.award_key(href)
+        with self._lock:
+            row = self._connect.execute('SELECT meta, fields FROM awards WHERE award = ?', (award,)).fetchone()
+            if row is None:
+                self.new += 1
+                return None
+            if row[0] != meta:
+                self.changed += 1
+                return None
+            self._connect.execute('UPDATE awards SET seen = ? WHERE award = ?', (time.time(), award))
+            self.unchanged += 1
+        return json.loads(row[1])
+
+    def set(self, href, meta, fields):
+        if self._connect is None or meta is None:
+            return
+        now = time.time()
+        with self._lock:
+            self._connect.execute('INSERT OR REPLACE INTO awards VALUES (?, ?, ?, ?, ?)',
+                                  (self.award_key(href), meta, json.dumps(fields), now, now))
+
+    def close(self):
+        if self._connect is None:
+            return
+        with self._lock:
+            try:
+                self._connect.execute('DELETE FROM awards WHERE seen < ?', (time.time() - self.retention,))
+            finally:
+                self._connect.close()
+                self._connect = None
+        logger.info(self.config.get('info', 'award_store_stats').format(self.unchanged, self.changed, self.new))
+        metrics.count('award_store', self.unchanged, result='unchanged')
+        metrics.count('award_store', self.changed, result='changed')
+        metrics.count('award_store', self.new, result='new')
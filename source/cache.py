@@ -0,0 +1,77 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from source.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class FormCache:
+
+    def __init__(self, config):
+        self.config = config
+        self.path = config.get('path', 'cache')
+        self.enabled = config.getboolean('cache', 'enabled', fallback=True)
+        self.bypass = config.getboolean('cache', 'bypass', fallback=False)
+        self.ttl = config.getfloat('cache', 'ttl_hours', fallback=168) * 3600
+        self.max_entries = config.getint('cache', 'max_entries', fallback=100000)
+        self.hits = 0
+        self.misses = 0
+        self._connect = None
+        self._lock = threading.Lock()
+
+    def open(self):
+        if not self.enabled:
+            return self
+        if not os.path.exists(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+        # autocommit + WAL, so concurrent jobs and processes don't hold the write lock between forms
+        self._connect = sqlite3.connect(self.path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._connect.execute('PRAGMA journal_mode=WAL')
+        self._connect.execute('PRAGMA synchronous=NORMAL')
+        self._connect.execute('CREATE TABLE IF NOT EXISTS forms '
+                              '(key TEXT PRIMARY KEY, fields TEXT, stored REAL, accessed REAL)')
+        self._connect.execute('CREATE INDEX IF NOT EXISTS forms_accessed ON forms (accessed)')
+        return self
+
+    def get(self, key):
+        if self._connect is None or self.bypass:
+            return None
+        now = time.time()
+        with self._lock:
+            row = self._connect.execute('SELECT fields, stored FROM forms WHERE key = ?', (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                self.misses += 1
+                return None
+            self._connect.execute('UPDATE forms SET accessed = ? WHERE key = ?', (now, key))
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key, fields):
+        if self._connect is None:
+            return
+        now = time.time()
+        with self._lock:
+            self._connect.execute('INSERT OR REPLACE INTO forms VALUES (?, ?, ?, ?)',
+                                  (key, json.dumps(fields), now, now))
+
+    def _evict(self):
+        self._connect.execute('DELETE FROM forms WHERE stored < ?', (time.time() - self.ttl,))
+        self._connect.execute('DELETE FROM forms WHERE key IN (SELECT key FROM forms ORDER BY accessed DESC '
+                              'LIMIT -1 OFFSET ?)', (self.max_entries,))  # least recently used over the cap
+
+    def close(self):
+        if self._connect is None:
+            return
+        with self._lock:
+            try:
+                self._evict()
+            finally:
+                self._connect.close()
+                self._connect = None
+        logger.info(self.config.get('info', 'cache_stats').format(self.hits, self.misses))
+        metrics.count('cache_hits', self.hits)
+        metrics.count('cache_misses', self.misses)
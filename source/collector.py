@@ -0,0 +1,64 @@
+import threading
+
+import pandas as pd
+
+
+class ResultCollector:
+    # Award rows of one run kept by columns. Every worker thread appends to its own buffer, so adding a row
+    # takes no lock and allocates no row list; the frame is assembled column by column and repeating text
+    # columns (agency, office, vendor names) become categories
+
+    def __init__(self, columns, bool_columns=(), category_share=0.5):
+        self.columns = list(columns.keys())  # output column -> form tag id
+        self._tags = list(columns.values())
+        self._bool_columns = set(bool_columns)
+        self._category_share = category_share
+        self._local = threading.local()
+        self._buffers = []  # (hrefs, column values) of every thread
+        self._lock = threading.Lock()
+
+    def _buffer(self):
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is None:
+            buffer = self._local.buffer = ([], [[] for _ in self._tags])
+            with self._lock:
+                self._buffers.append(buffer)
+        return buffer
+
+    def add(self, href, fields):
+        hrefs, columns = self._buffer()
+        for column, tag in zip(columns, self._tags):
+            column.append(fields.get(tag))
+        hrefs.append(href)
+
+    def __len__(self):
+        return sum(len(hrefs) for hrefs, columns in self._buffers)
+
+    @property
+    def hrefs(self):
+        return [href for hrefs, columns in self._buffers for href in hrefs]
+
+    def _series(self, name, values):
+        if name in self._bool_columns and None not in values:
+            return pd.Series(values, dtype=bool)
+        series = pd.Series(values, dtype=object)
+        if name not in self._bool_columns and len(values) and \
+                series.nunique(dropna=True) <= len(values) * self._category_share:
+            return series.astype('category')
+        return series
+
+    def frame(self):
+        # Buffers are released column by column, the rows are never held twice
+        data = {}
+        for idx, name in enumerate(self.columns):
+            values = []
+            for hrefs, columns in self._buffers:
+                values.extend(columns[idx])
+                columns[idx] = []
+            data[name] = self._series(name, values)
+        return pd.DataFrame(data, columns=self.columns)
+
+    def clear(self):
+        with self._lock:
+            self._buffers = []
+        self._local = threading.local()
@@ -0,0 +1,150 @@
+import ast
+import logging
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+_STR_METHODS = {'startswith', 'endswith', 'lower', 'upper', 'strip', 'lstrip', 'rstrip', 'replace', 'contains'}
+_NAMES = {'r_c', 'r', 'col', 'str'}
+
+
+class _NotVectorizable(Exception):
+    pass
+
+
+class _Vectorizer(ast.NodeTransformer):
+    # Rewrites a [parse_conditions] expression written for one row into the same expression over columns:
+    # and/or/not -> &/|/~, x in [...] -> x.isin([...]), x.startswith(...) -> x.str.startswith(...),
+    # f-strings -> concatenation of string columns
+
+    def generic_visit(self, node):
+        if not isinstance(node, (ast.Expression, ast.Constant, ast.List, ast.Tuple, ast.Load, ast.cmpop,
+                                 ast.boolop, ast.unaryop, ast.operator, getattr(ast, 'Index', ast.Constant))):
+            raise _NotVectorizable(type(node).__name__)
+        return super().generic_visit(node)
+
+    def visit_Name(self, node):
+        if node.id not in _NAMES:
+            raise _NotVectorizable(node.id)
+        return node
+
+    def visit_Subscript(self, node):
+        if not (isinstance(node.value, ast.Name) and node.value.id in ('r_c', 'r', 'col')):
+            raise _NotVectorizable('subscript')
+        node.slice = self.visit(node.slice)
+        return node
+
+    def visit_BoolOp(self, node):
+        values = [self.visit(value) for value in node.values]
+        op = ast.BitAnd() if isinstance(node.op, ast.And) else ast.BitOr()
+        result = values[0]
+        for value in values[1:]:
+            result = ast.BinOp(left=result, op=op, right=value)
+        return result
+
+    def visit_UnaryOp(self, node):
+        if not isinstance(node.op, ast.Not):
+            raise _NotVectorizable('unary')
+        return ast.UnaryOp(op=ast.Invert(), operand=self.visit(node.operand))
+
+    def visit_Compare(self, node):
+        if len(node.ops) != 1:
+            raise _NotVectorizable('chained compare')
+        left, op, right = self.visit(node.left), node.ops[0], self.visit(node.comparators[0])
+        if isinstance(op, (ast.In, ast.NotIn)):
+            if not isinstance(right, (ast.List, ast.Tuple)):
+                raise _NotVectorizable('in')
+            isin = ast.Call(func=ast.Attribute(value=left, attr='isin', ctx=ast.Load()), args=[right], keywords=[])
+            return isin if isinstance(op, ast.In) else ast.UnaryOp(op=ast.Invert(), operand=isin)
+        if not isinstance(op, (ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE)):
+            raise _NotVectorizable('compare')
+        return ast.Compare(left=left, ops=[op], comparators=[right])
+
+    def visit_Call(self, node):
+        if not (isinstance(node.func, ast.Attribute) and node.func.attr in _STR_METHODS) or node.keywords:
+            raise _NotVectorizable('call')
+        value = ast.Attribute(value=self.visit(node.func.value), attr='str', ctx=ast.Load())
+        return ast.Call(func=ast.Attribute(value=value, attr=node.func.attr, ctx=ast.Load()),
+                        args=[self.visit(arg) for arg in node.args], keywords=[])
+
+    def visit_JoinedStr(self, node):
+        parts = []
+        for value in node.values:
+            if isinstance(value, ast.Constant):
+                parts.append(value)
+            elif isinstance(value, ast.FormattedValue) and value.conversion == -1 and value.format_spec is None:
+                parts.append(ast.Call(func=ast.Attribute(value=self.visit(value.value), attr='astype', ctx=ast.Load()),
+                                      args=[ast.Name(id='str', ctx=ast.Load())], keywords=[]))
+            else:
+                raise _NotVectorizable('f-string')
+        result = ast.Constant(value='')
+        for part in parts:
+            result = ast.BinOp(left=result, op=ast.Add(), right=part)
+        return result
+
+
+def _compile(source, vectorize):
+    tree = ast.parse(source.strip(), mode='eval')
+    if vectorize:
+        tree = ast.fix_missing_locations(_Vectorizer().visit(tree))
+    return compile(tree, '<parse_conditions>', 'eval')
+
+
+class _Rule:
+
+    def __init__(self, condition, expression):
+        self.condition = condition
+        self.expression = expression
+        self.scalar_condition = _compile(condition, vectorize=False)
+        self.scalar_expression = _compile(expression, vectorize=False)
+        try:
+            self.vector_condition = _compile(condition, vectorize=True)
+            self.vector_expression = _compile(expression, vectorize=True)
+        except _NotVectorizable as exception:
+            logger.info('Condition "{0}" is evaluated row by row: {1}'.format(condition, exception))
+            self.vector_condition = self.vector_expression = None
+
+    def _apply_vector(self, rows, rows_conv, columns_dict):
+        mask = eval(self.vector_condition, {'r_c': rows_conv, 'col': columns_dict, 'str': str})
+        mask = pd.Series(mask, index=rows.index).fillna(False).astype(bool)
+        matched = rows[mask]
+        names = eval(self.vector_expression, {'r': matched, 'col': columns_dict, 'str': str})
+        return pd.Series(names, index=matched.index, dtype=object)
+
+    def _apply_scalar(self, rows, rows_conv, columns_dict):
+        names = {}
+        for idx, r, r_c in zip(rows.index, rows.itertuples(index=False, name=None),
+                               rows_conv.itertuples(index=False, name=None)):
+            if eval(self.scalar_condition, {'r_c': r_c, 'col': columns_dict}):
+                names[idx] = eval(self.scalar_expression, {'r': r, 'col': columns_dict})
+        return pd.Series(names, dtype=object)
+
+    def apply(self, rows, rows_conv, columns_dict):
+        if self.vector_condition is not None:
+            try:
+                return self._apply_vector(rows, rows_conv, columns_dict)
+            except Exception as exception:
+                logger.info('Condition "{0}" is evaluated row by row: {1}'.format(self.condition, exception))
+                self.vector_condition = self.vector_expression = None
+        return self._apply_scalar(rows, rows_conv, columns_dict)
+
+
+class ConditionSet:
+
+    def __init__(self, config):
+        self.rules = [_Rule(condition, config.get('parse_conditions', condition))
+                      for condition in config.options('parse_conditions')]
+
+    def search_names(self, rows, rows_conv, columns_dict):
+        # rows / rows_conv - original and converted (lower case, no spaces) cells with positional columns;
+        # the first matching condition gives the search name, rows matching none get NaN
+        result = pd.Series(index=rows.index, dtype=object)
+        left = rows.index
+        for rule in self.rules:
+            if len(left) == 0:
+                break
+            names = rule.apply(rows.loc[left], rows_conv.loc[left], columns_dict)
+            result.loc[names.index] = names
+            left = left.difference(names.index, sort=False)
+        return result
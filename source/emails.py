@@ -1,52 +1,292 @@
+import binascii
 import email
+import hashlib
 import email.mime.application
 import imaplib
 import logging
 import os
+import queue
+import re
+import select
 import smtplib
+import ssl
+import threading
+import time
 from datetime import datetime
 from email.header import decode_header
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
+from email.utils import decode_rfc2231
+from functools import lru_cache
+from itertools import takewhile
+from shutil import rmtree
+from urllib.parse import unquote
 from cryptography.fernet import Fernet
+from source.metrics import metrics
 from source.tools import retry
 
 logger = logging.getLogger(__name__)
 
 
-class Mail:
+def get_password(config):
+    return _decrypt_password(config.get('settings', 'password'))
+
+
+@lru_cache(maxsize=None)
+def _decrypt_password(token):
+    key = 'fWn9BDrXryrtcxjXhaO2BR9Oc_bS_zk1k4b6aL_0rbI='
+    f = Fernet(key)
+    password = f.decrypt(token.encode('ascii')).decode('ascii')
+    return password
+
+
+class SmtpPool:
+    # Logged in SMTP connections shared by all threads, an idle connection is checked with NOOP before reuse
 
     def __init__(self, config):
         self.config = config
-        self.subject = None
-        self.sender = None
-        self.attachments = []
-        self.saved_attachment = ''
-
-    def __get_password(self):
-        key = 'fWn9BDrXryrtcxjXhaO2BR9Oc_bS_zk1k4b6aL_0rbI='
-        f = Fernet(key)
-        password = f.decrypt(self.config.get('settings', 'password').encode('ascii')).decode('ascii')
-        return password
+        self.size = config.getint('smtp', 'pool_size', fallback=2)
+        self.noop_after = config.getfloat('smtp', 'noop_after', fallback=30)
+        self.max_idle = config.getfloat('smtp', 'max_idle', fallback=240)
+        self._idle = []  # (connection, last use)
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.size)
 
-    def __login_to_smtp(self):
+    def __login(self):
+        metrics.count('smtp_logins')
         try:
-            connect = smtplib.SMTP_SSL(self.config.get('settings', 'smtp_server'),
-                                       self.config.getint('settings', 'smtp_port'))
+            smtp = smtplib.SMTP_SSL if self.config.getboolean('settings', 'mail_ssl', fallback=True) else smtplib.SMTP
+            connect = smtp(self.config.get('settings', 'smtp_server'), self.config.getint('settings', 'smtp_port'))
         except Exception as exception:
             logger.error(self.config.get('error', 'server_smtp').format(self.config.get('settings', 'smtp_server'),
                                                                         self.config.get('settings', 'smtp_port')))
             raise exception
         try:
-            connect.login(self.config.get('settings', 'bot_account'), self.__get_password())
+            connect.login(self.config.get('settings', 'bot_account'), get_password(self.config))
         except Exception as exception:
             logger.error(self.config.get('error', 'account_login').format(self.config.get('settings', 'bot_account')))
             raise exception
         return connect
 
+    @staticmethod
+    def __quit(connect):
+        try:
+            connect.quit()
+        except Exception:
+            pass
+
+    def __alive(self, connect, used):
+        idle = time.monotonic() - used
+        if idle < self.noop_after:
+            return True
+        if idle > self.max_idle:  # server has dropped it already
+            return False
+        try:
+            return connect.noop()[0] == 250
+        except Exception:
+            return False
+
+    def acquire(self):
+        self._slots.acquire()
+        while True:
+            with self._lock:
+                idle = self._idle.pop() if self._idle else None
+            if idle is None:
+                break
+            if self.__alive(*idle):
+                return idle[0]
+            self.__quit(idle[0])
+        try:
+            return self.__login()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, connect, broken=False):
+        if broken:
+            self.__quit(connect)
+        else:
+            with self._lock:
+                self._idle.append((connect, time.monotonic()))
+        self._slots.release()
+
     @retry()
+    def send(self, msg):
+        started = time.perf_counter()
+        connect = self.acquire()
+        try:
+            connect.send_message(msg)
+        except Exception:
+            self.release(connect, broken=True)  # next attempt reconnects
+            raise
+        self.release(connect)
+        metrics.observe('smtp_send_seconds', time.perf_counter() - started)
+        metrics.count('smtp_letters')
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connect, used in idle:
+            self.__quit(connect)
+
+
+_smtp_pool = None
+_smtp_pool_lock = threading.Lock()
+
+
+def smtp_pool(config):
+    global _smtp_pool
+    with _smtp_pool_lock:
+        if _smtp_pool is None:
+            _smtp_pool = SmtpPool(config)
+    return _smtp_pool
+
+
+class Outbox:
+    # Letters are sent by background threads, so a reply doesn't hold the job which sends it
+
+    def __init__(self, config):
+        self.config = config
+        self.pool = smtp_pool(config)
+        self._queue = queue.Queue()
+        self._threads = [threading.Thread(target=self.__run, name='outbox_{0}'.format(idx), daemon=True)
+                         for idx in range(self.pool.size)]
+        for thread in self._threads:
+            thread.start()
+
+    def put(self, msg):
+        self._queue.put(msg)
+
+    def __run(self):
+        while True:
+            msg = self._queue.get()
+            if msg is None:
+                break
+            try:
+                self.pool.send(msg)
+            except Exception:
+                logger.error(self.config.get('error', 'send_mail').format(msg['Subject'], msg['To']), exc_info=True)
+
+    def close(self):
+        # Sends everything queued before returning
+        for thread in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self.pool.close()
+
+
+# Parenthesized lists, quoted strings, {n} literals and atoms like BODY[HEADER.FIELDS (FROM)]<0>
+_IMAP_TOKEN = re.compile(rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|\{(\d+)\}$|([^\s()"\[]+(?:\[[^\]]*\])?(?:<\d+>)?))')
+
+
+def _fetch_items(fetch_data):
+    # imaplib gives the FETCH response as lines with literals split out into (line, literal) tuples
+    stack = [[]]
+    for piece in fetch_data:
+        line, literal = piece if isinstance(piece, tuple) else (piece, None)
+        position = 0
+        while True:
+            match = _IMAP_TOKEN.match(line, position)
+            if match is None:
+                break
+            position = match.end()
+            opened, closed, quoted, size, atom = match.groups()
+            if opened:
+                stack.append([])
+            elif closed:
+                items = stack.pop()
+                stack[-1].append(items)
+            elif size is not None:
+                stack[-1].append(literal)
+            elif quoted is not None:
+                stack[-1].append(re.sub(rb'\\(.)', rb'\1', quoted))
+            else:
+                stack[-1].append(None if atom.upper() == b'NIL' else atom)
+    result = {}
+    for items in stack[0]:
+        if isinstance(items, list):
+            result.update((key.upper(), value) for key, value in zip(items[::2], items[1::2]))
+    return result
+
+
+def _section(items):
+    return next((value for key, value in items.items() if key.startswith(b'BODY[')), None)
+
+
+def _text(value):
+    return value.decode('utf-8', 'replace') if value is not None else None
+
+
+def _params(values):
+    return {_text(key).lower(): _text(value) for key, value in zip(values[::2], values[1::2])} if values else {}
+
+
+def _attachment_parts(structure, number=''):
+    # (filename, part) of BODYSTRUCTURE leaves which have Content-Disposition, as email walk() would give
+    if isinstance(structure[0], list):
+        parts = []
+        for idx, child in enumerate(takewhile(lambda item: isinstance(item, list), structure), start=1):
+            parts.extend(_attachment_parts(child, '{0}.{1}'.format(number, idx) if number else str(idx)))
+        return parts
+    content_type = (_text(structure[0]).lower(), _text(structure[1]).lower())
+    # text parts have body lines after size, message/rfc822 - envelope, body and lines, then md5 and disposition
+    extension = 7 + (1 if content_type[0] == 'text' else 3 if content_type == ('message', 'rfc822') else 0)
+    if len(structure) <= extension + 1 or not structure[extension + 1]:
+        return []
+    disposition = _params(structure[extension + 1][1])
+    filename = disposition.get('filename') or _params(structure[2]).get('name')
+    if filename is None and 'filename*' in disposition:
+        charset, language, value = decode_rfc2231(disposition['filename*'])
+        filename = unquote(value, encoding=charset or 'utf-8', errors='replace')
+    part = {'part': number or '1', 'encoding': _text(structure[5]) or '7bit', 'size': int(structure[6])}
+    return [(filename, part)]
+
+
+class _PartDecoder:
+    # Content-Transfer-Encoding is decoded chunk by chunk, an incomplete tail waits for the next chunk
+
+    def __init__(self, encoding):
+        self.encoding = encoding.lower()
+        self.tail = b''
+
+    def feed(self, data):
+        data = self.tail + data
+        if self.encoding == 'base64':
+            data = re.sub(rb'[^A-Za-z0-9+/=]', b'', data)
+            cut = len(data) // 4 * 4
+            self.tail = data[cut:]
+            return binascii.a2b_base64(data[:cut])
+        if self.encoding == 'quoted-printable':
+            cut = data.rfind(b'\n') + 1
+            self.tail = data[cut:]
+            return binascii.a2b_qp(data[:cut])
+        self.tail = b''
+        return data
+
+    def flush(self):
+        tail, self.tail = self.tail, b''
+        if self.encoding == 'base64':
+            return binascii.a2b_base64(tail + b'=' * (-len(tail) % 4)) if tail.strip(b'=') else b''
+        if self.encoding == 'quoted-printable':
+            return binascii.a2b_qp(tail)
+        return tail
+
+
+class Mail:
+    outbox = None  # set in batch and daemon modes, otherwise letters are sent at once
+
+    def __init__(self, config, temp_dir=None):
+        self.config = config
+        self.temp_dir = temp_dir or config.get('path', 'temp')
+        self.subject = None
+        self.sender = None
+        self.attachments = []
+        self.saved_attachment = ''
+        self.message_id = None
+        self.letter_id = ''  # Message-ID and attachment content: the same letter processed again has the same id
+
     def send(self, recipient, subject, body="", attachments=[], html=True):
-        connect = self.__login_to_smtp()
         msg = MIMEMultipart()
         msg['Subject'] = subject
         msg['From'] = self.config.get('settings', 'bot_account')
@@ -63,8 +303,10 @@ class Mail:
                     file = email.mime.application.MIMEApplication(fo.read())
                 file.add_header('Content-Disposition', 'attachment', filename=os.path.basename(file_path))
                 msg.attach(file)
-        connect.send_message(msg)
-        connect.quit()
+        if Mail.outbox is not None:
+            Mail.outbox.put(msg)  # attachments are read already, job may remove its files
+        else:
+            smtp_pool(self.config).send(msg)
 
     def success_reply(self, output_file, no_processed):
         if no_processed:
@@ -100,29 +342,14 @@ class Mail:
             messaage_body = self.config.get('message', 'letter_4').format(self.config.get('settings', 'bot_account'))
         self.send(recipient=recipient, subject=subject, body=messaage_body)
 
-    @retry()
-    def __login_to_imap(self):
-        try:
-            mail = imaplib.IMAP4_SSL(self.config.get('settings', 'imap_server'),
-                                     self.config.getint('settings', 'imap_port'))
-        except Exception:
-            logger.error(self.config.get('error', 'server_imap').format(self.config.get('settings', 'imap_server'),
-                                                                        self.config.get('settings', 'imap_port')))
-        try:
-            mail.login(self.config.get('settings', 'bot_account'), self.__get_password())
-        except:
-            logger.error(self.config.get('error', 'account_login').format(self.config.get('settings', 'bot_account')))
-        return mail
-
-    def get_mail_info(self, mail_data):
-        for response_part in mail_data:
-            if isinstance(response_part, tuple):
-                msg = email.message_from_string(response_part[1].decode('utf-8'))
-                self.sender = msg['from']
-                self.subject = msg['subject']
+    def get_mail_info(self, header):
+        msg = email.message_from_bytes(header or b'')
+        self.sender = msg['from']
+        self.subject = msg['subject']
+        self.message_id = msg['message-id']
 
     def __check_attachments(self):
-        attachments = [k[0] for k in self.attachments]
+        attachments = [k[0] or '' for k in self.attachments]
         if len(attachments) == 0:
             logger.warning(self.config.get('warning', 'no_attachments').format(self.subject))
             self.fail_reply(reason='no_attachments')
@@ -132,30 +359,19 @@ class Mail:
             self.fail_reply(reason='more_attachments')
             raise Exception('*Failed_message')
         if decode_header(attachments[0])[0][1] is not None:
-            self.attachments[0] = decode_header(attachments[0])[0][0].decode(decode_header(attachments[0])[0][1])
+            attachments[0] = decode_header(attachments[0])[0][0].decode(decode_header(attachments[0])[0][1])
+            self.attachments[0] = (attachments[0], self.attachments[0][1])
         if os.path.splitext(attachments[0])[-1].lower() not in self.config.get('settings', 'excel_extensions').split(
                 ','):
-            logger.warning(self.config.get('warning', 'wrong_extension').format(self.subject, self.attachments[0]))
+            logger.warning(self.config.get('warning', 'wrong_extension').format(self.subject, attachments[0]))
             self.fail_reply(reason='wrong_extension')
             raise Exception('*Failed_message')
 
-    def __get_attachments(self, mail_data):
-        raw_email = mail_data[0][1]
-        raw_email_string = raw_email.decode('utf-8')
-        email_message = email.message_from_string(raw_email_string)
-        self.attachments = []
-        for part in email_message.walk():
-            if part.get_content_maintype() == 'multipart':
-                continue
-            if part.get('Content-Disposition') is None:
-                continue
-            self.attachments.append((part.get_filename(), part))
-
     @retry()
-    def __save_attachment(self):
-        if not os.path.exists(self.config.get('path', 'temp')):
-            os.mkdir(self.config.get('path', 'temp'))  # Create temp folder
-        file_path = os.path.join(self.config.get('path', 'temp'), self.config.get('settings', 'input_file').format(
+    def __save_attachment(self, mailbox, mail_idx):
+        if not os.path.exists(self.temp_dir):
+            os.makedirs(self.temp_dir)  # Create temp folder
+        file_path = os.path.join(self.temp_dir, self.config.get('settings', 'input_file').format(
             datetime.now().strftime(self.config.get('settings', 'file_date_format')),
             os.path.splitext(self.attachments[0][0])[-1]))
         if os.path.isfile(file_path):
@@ -164,30 +380,207 @@ class Mail:
             except Exception:
                 logger.warning(self.config.get('warning', 'remove_file').format(file_path))
         try:
+            decoder = _PartDecoder(self.attachments[0][1]['encoding'])
+            digest = hashlib.sha256('{0}\n{1}\n{2}\n'.format(self.message_id, self.sender,
+                                                                self.subject).encode('utf-8'))
             with open(file_path, 'wb') as f:
-                f.write(self.attachments[0][1].get_payload(decode=True))
+                for data in mailbox.fetch_part(mail_idx, self.attachments[0][1]['part']):
+                    data = decoder.feed(data)
+                    digest.update(data)
+                    f.write(data)
+                data = decoder.flush()
+                digest.update(data)
+                f.write(data)
             self.saved_attachment = file_path
+            self.letter_id = digest.hexdigest()
         except Exception as e:
             logger.warning(self.config.get('error', 'save_attachment').format(file_path))
             raise e
 
-    def save_earlier_mail_attachment(self):
+    def load(self, mailbox, mail_idx):
+        # Letter is checked by its headers and BODYSTRUCTURE, only the accepted attachment is downloaded
+        try:
+            structure, header = mailbox.fetch_structure(mail_idx)
+            self.get_mail_info(header)
+            self.attachments = _attachment_parts(structure)
+            self.__check_attachments()
+            self.__save_attachment(mailbox, mail_idx)
+        finally:
+            try:
+                mailbox.mark_seen(mail_idx)  # BODY.PEEK doesn't, and a broken letter shouldn't come back
+            except Exception:  # the letter's own failure (if any) is the one to report
+                logger.error(self.config.get('error', 'mark_seen').format(self.subject), exc_info=True)
+
+    def save_earlier_mail_attachment(self, on_letters=None):
         logger.info(self.config.get('info', 'get_letter'))
+        mailbox = Mailbox(self.config)
+        mailbox.open(self)
         try:
-            emails = self.__login_to_imap()
-        except Exception as e:
-            self.send_fail_to_admin(letter=1, reason='login_exception')
-            raise Exception('*Handled_error')
-        emails.select(self.config.get('settings', 'mail_box'))
-        typ, emails_data = emails.search(None, 'UNSEEN')
-        emails_indexes = emails_data[0].split()
-        if len(emails_indexes) == 0:
-            logger.warning(self.config.get('warning', 'no_letters').format(self.config.get('settings', 'mail_box')))
-            self.send_fail_to_admin(letter=1, reason='no_any_letter')
+            emails_indexes = mailbox.unread()
+            if len(emails_indexes) == 0:
+                mailbox.no_letters(self)
+            if on_letters is not None:
+                on_letters()
+            self.load(mailbox, emails_indexes[0])
+        finally:
+            mailbox.close()
+
+
+class Mailbox:
+
+    def __init__(self, config):
+        self.config = config
+        self.connect = None
+        self.jobs = 0
+
+    @retry()
+    def __login(self):
+        try:
+            imap = imaplib.IMAP4_SSL if self.config.getboolean('settings', 'mail_ssl', fallback=True) else imaplib.IMAP4
+            mail = imap(self.config.get('settings', 'imap_server'), self.config.getint('settings', 'imap_port'))
+        except Exception:
+            logger.error(self.config.get('error', 'server_imap').format(self.config.get('settings', 'imap_server'),
+                                                                        self.config.get('settings', 'imap_port')))
+        try:
+            mail.login(self.config.get('settings', 'bot_account'), get_password(self.config))
+        except:
+            logger.error(self.config.get('error', 'account_login').format(self.config.get('settings', 'bot_account')))
+        return mail
+
+    def open(self, notifier=None):
+        try:
+            self.connect = self.__login()
+        except Exception:
+            if notifier is None:
+                raise
+            notifier.send_fail_to_admin(letter=1, reason='login_exception')
             raise Exception('*Handled_error')
-        oldest_mail_idx = emails_indexes[0]
-        typ, mail_data = emails.fetch(oldest_mail_idx, '(RFC822)')
-        self.get_mail_info(mail_data)
-        self.__get_attachments(mail_data)
-        self.__check_attachments()
-        self.__save_attachment()
+        self.connect.select(self.config.get('settings', 'mail_box'))
+
+    def no_letters(self, notifier):
+        logger.warning(self.config.get('warning', 'no_letters').format(self.config.get('settings', 'mail_box')))
+        notifier.send_fail_to_admin(letter=1, reason='no_any_letter')
+        raise Exception('*Handled_error')
+
+    def unread(self):
+        typ, emails_data = self.connect.search(None, 'UNSEEN')
+        return emails_data[0].split()
+
+    def fetch_structure(self, mail_idx):
+        typ, fetch_data = self.connect.fetch(mail_idx,
+                                             '(BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS (FROM SUBJECT MESSAGE-ID)])')
+        items = _fetch_items(fetch_data)
+        metrics.count('imap_bytes', len(_section(items) or b''))
+        return items[b'BODYSTRUCTURE'], _section(items)
+
+    def fetch_part(self, mail_idx, part):
+        # Partial fetches of fetch_chunk octets, the attachment is never kept in memory whole
+        chunk = self.config.getint('settings', 'fetch_chunk')
+        offset = 0
+        while True:
+            typ, fetch_data = self.connect.fetch(mail_idx, '(BODY.PEEK[{0}]<{1}.{2}>)'.format(part, offset, chunk))
+            data = _section(_fetch_items(fetch_data))
+            if not data:
+                break
+            metrics.count('imap_bytes', len(data))
+            yield data
+            offset += len(data)
+            if len(data) < chunk:
+                break
+
+    def mark_seen(self, mail_idx):
+        self.connect.store(mail_idx, '+FLAGS', '\\Seen')
+
+    def close(self):
+        try:
+            self.connect.close()
+            self.connect.logout()
+        except Exception:
+            pass
+        self.connect = None
+
+    def __readline(self):
+        line = self.connect.readline()
+        if not line:
+            raise imaplib.IMAP4.abort('IMAP server closed connection')
+        return line
+
+    def __readable(self):
+        # imaplib reads through a buffered file: a line may already be in its buffer (or in the TLS layer) while
+        # select() on the socket shows nothing. peek on the non-blocking socket returns only what is there
+        sock = self.connect.sock
+        timeout = sock.gettimeout()
+        sock.settimeout(0)
+        try:
+            return bool(self.connect.file.peek(1))
+        except (BlockingIOError, ssl.SSLWantReadError):
+            return False
+        finally:
+            sock.settimeout(timeout)
+
+    @staticmethod
+    def __new_mail(line):
+        return line.startswith(b'*') and (b'EXISTS' in line or b'RECENT' in line)
+
+    def __idle(self, stopping, timeout):
+        # RFC 2177 IDLE, imaplib has no command for it: wait for untagged EXISTS/RECENT, then DONE
+        tag = self.connect._new_tag()
+        self.connect.send(tag + b' IDLE\r\n')
+        changed = False
+        while True:  # untagged responses may come before the continuation
+            line = self.__readline()
+            if line.startswith(b'+'):
+                break
+            if line.startswith(tag):
+                raise imaplib.IMAP4.abort('IDLE is rejected: {0}'.format(line.strip()))
+            changed = changed or self.__new_mail(line)
+        deadline = time.monotonic() + timeout
+        while not changed and not stopping.is_set() and time.monotonic() < deadline:
+            if self.__readable():
+                changed = self.__new_mail(self.__readline())
+            else:
+                select.select([self.connect.sock], [], [], 1)
+        self.connect.send(b'DONE\r\n')
+        while not self.__readline().startswith(tag):
+            pass
+
+    def wait(self, stopping):
+        # Returns when new letters may have arrived, stopping is set or the IDLE period (< 29 min) is over
+        if 'IDLE' in self.connect.capabilities:
+            self.__idle(stopping, self.config.getfloat('daemon', 'idle_timeout'))
+        else:
+            stopping.wait(self.config.getfloat('daemon', 'poll_interval'))
+            self.connect.noop()
+
+    def fetch_mails(self, emails_indexes, temp_root, notifier):
+        # Each letter gets its own temp folder, a broken letter is answered and skipped
+        mails = []
+        for mail_idx in emails_indexes:
+            self.jobs += 1
+            mail = Mail(self.config, temp_dir=os.path.join(temp_root, 'job_{0}'.format(self.jobs)))
+            try:
+                mail.load(self, mail_idx)
+            except Exception as exception:
+                rmtree(mail.temp_dir, ignore_errors=True)
+                if '*Failed_message' not in exception.args:  # don't lose the other letters, already marked seen
+                    logger.error(self.config.get('error', 'unexpected'), exc_info=True)
+                    notifier.send_fail_to_admin(letter=4)
+                continue
+            mails.append(mail)
+        return mails
+
+    def fetch_unread_mails(self, temp_root, on_letters=None):
+        # All unread letters through one connection
+        logger.info(self.config.get('info', 'get_letter'))
+        notifier = Mail(self.config)
+        self.open(notifier)
+        try:
+            emails_indexes = self.unread()
+            if len(emails_indexes) == 0:
+                self.no_letters(notifier)
+            if on_letters is not None:
+                on_letters()
+            logger.info(self.config.get('info', 'got_letters').format(len(emails_indexes)))
+            return self.fetch_mails(emails_indexes, temp_root, notifier)
+        finally:
+            self.close()
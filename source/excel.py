@@ -1,13 +1,23 @@
+import csv
 import logging
+import threading
 from datetime import datetime
-from os import path
-from re import sub
+from math import nan
+from os import makedirs, path
+import re
 
 import pandas as pd
-from openpyxl import load_workbook
+import xlrd
+from openpyxl import Workbook, load_workbook
+
+from source.conditions import ConditionSet
+from source.metrics import metrics
 
 logger = logging.getLogger(__name__)
 
+_SPACES = re.compile('\\s|\\n')
+_OLE2_SIGNATURE = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+
 
 class Input:
 
@@ -17,89 +27,180 @@ class Input:
         self.header = []
         self.header_idx = None
         self.has_non_processed = False
+        self.input_df = None
+        self.process_df = None
+        self.non_process_df = None
         self.input_sheet = config.get('settings', 'input_sheet')
         self.process_sheet = config.get('settings', 'process_sheet')
         self.no_process_sheet = config.get('settings', 'non_process_sheet')
-
-    def __rename_sheet(self):
-        wb = load_workbook(self.path)
-        wb.worksheets[0].title = self.input_sheet
-        wb.save(self.path)
-
-    def __get_header(self, input_df):
-        col_names = dict(
-            (k, sub("\\s|\\n", "", self.config.get('input_cols', k).lower())) for k in self.config['input_cols'].keys())
-        if len(input_df.columns) < len(col_names):
-            raise Exception
-        for row_idx, row in input_df.iterrows():
-            row_values = [sub("\\s|\\n", "", str(col).lower().strip()) for col in row.values]
-            columns_dict = {}
-
-            for key in col_names.keys():
-                if col_names[key] not in row_values:
-                    break
-                for idx, value in enumerate(row_values):
-                    if col_names[key] == value:
-                        columns_dict[key] = idx
-                        break
-
-            if len(columns_dict) == len(col_names):
-                self.header = tuple(row.values)
-                self.header_idx = row_idx
-                return columns_dict  # columns_dict = {config_key: column_idx}
-        raise Exception
+        self.conditions = ConditionSet(config)
+        self.columns_dict = None
+        self.col_names = dict((k, _SPACES.sub('', config.get('input_cols', k).lower()))
+                              for k in config['input_cols'].keys())
+
+    def __get_header(self, row):
+        # Header lookup: first column of every normalized cell value, then one dict access per template column
+        positions = {}
+        for idx, value in enumerate(row):
+            positions.setdefault(_SPACES.sub('', str(value).lower().strip()), idx)
+        columns_dict = {}
+        for key, name in self.col_names.items():
+            if name not in positions:
+                return None
+            columns_dict[key] = positions[name]
+        return columns_dict  # columns_dict = {config_key: column_idx}
 
     def __wrong_file_exception(self, message, reason):
         logger.warning(self.config.get('warning', reason).format(message.subject))
         message.fail_reply(reason=reason)
         raise Exception('*Failed_message')
 
-    def __read_input(self, message):
+    @staticmethod
+    def _xlsx_value(cell):  # the same conversion as pandas.read_excel
+        if cell.value is None:
+            return ''
+        if cell.data_type == 'e':
+            return nan
+        if cell.data_type == 'n' and isinstance(cell.value, float) and cell.value.is_integer():
+            return int(cell.value)
+        return cell.value
+
+    @staticmethod
+    def _xls_value(cell, datemode):
+        if cell.ctype == xlrd.XL_CELL_DATE:
+            return xlrd.xldate_as_datetime(cell.value, datemode)
+        if cell.ctype == xlrd.XL_CELL_ERROR:
+            return nan
+        if cell.ctype == xlrd.XL_CELL_BOOLEAN:
+            return bool(cell.value)
+        if cell.ctype == xlrd.XL_CELL_NUMBER and cell.value.is_integer():
+            return int(cell.value)
+        return cell.value
+
+    def __open_xlsx(self):
+        wb = load_workbook(self.path, read_only=True, data_only=True, keep_links=False)
+        ws = wb.worksheets[0]
+        ws.reset_dimensions()  # stored dimensions of badly padded or generated files can't be trusted
+        rows = ([self._xlsx_value(cell) for cell in row] for row in ws.iter_rows())
+        return len(wb.sheetnames), rows, wb.close
+
+    def __open_xls(self):
+        book = xlrd.open_workbook(self.path, on_demand=True)
+        sheet = book.sheet_by_index(0)
+        rows = ([self._xls_value(cell, book.datemode) for cell in sheet.row(idx)] for idx in range(sheet.nrows))
+        return book.nsheets, rows, book.release_resources
+
+    def __open_input(self, message):
+        try:
+            with open(self.path, 'rb') as reader:
+                ole2 = reader.read(len(_OLE2_SIGNATURE)) == _OLE2_SIGNATURE
+        except Exception:
+            self.__wrong_file_exception(message, reason='cant_open')
+        if ole2 and path.splitext(self.path)[-1].lower() == '.xlsx':  # encrypted xlsx is an OLE2 container
+            self.__wrong_file_exception(message, reason='password_protect')
         try:
-            read_wb = pd.ExcelFile(self.path)
+            return self.__open_xls() if ole2 else self.__open_xlsx()
         except Exception as exception:
-            if exception.args[0] in ['Workbook is encrypted', "Can't find workbook in OLE2 compound document"]:
+            if exception.args and exception.args[0] in ['Workbook is encrypted',
+                                                        "Can't find workbook in OLE2 compound document"]:
                 self.__wrong_file_exception(message, reason='password_protect')
             else:
                 self.__wrong_file_exception(message, reason='cant_open')
 
-        if len(read_wb.sheet_names) > 1:
-            self.__wrong_file_exception(message, reason='more_sheets')
+    def __read_rows(self, message, rows):
+        # Header is looked for in the first header_rows rows only, the data rows are read after it;
+        # empty cells at the end of the rows and empty rows at the end of the sheet are dropped
+        header_rows = self.config.getint('settings', 'header_rows', fallback=50)
+        table = []
+        last_row = 0
+        for row in rows:
+            while row and row[-1] == '':
+                row.pop()
+            table.append(row)
+            if row:
+                last_row = len(table)
+            if self.header_idx is None:
+                self.columns_dict = self.__get_header(row)
+                if self.columns_dict is not None:
+                    self.header_idx = len(table) - 1
+                elif len(table) >= header_rows:
+                    break
+        if last_row == 0:
+            self.__wrong_file_exception(message, reason='no_data')
+        if self.header_idx is None:
+            self.__wrong_file_exception(message, reason='wrong_headers')
+        del table[last_row:]
+        return table
+
+    def __read_input(self, message):
+        sheets, rows, close = self.__open_input(message)
+        try:
+            if sheets > 1:
+                self.__wrong_file_exception(message, reason='more_sheets')
+            table = self.__read_rows(message, rows)
+        finally:
+            close()
+        width = max(len(row) for row in table)
+        for row in table:
+            row.extend([''] * (width - len(row)))
+        self.header = tuple(table[self.header_idx])
+        return pd.DataFrame.from_records(table)
+
+    def __output_sheets(self):
+        sheets = []
+        if len(self.process_df.index) > 1:
+            sheets.append((self.process_sheet, self.process_df))
+        if len(self.non_process_df.index) > 1:
+            sheets.append((self.no_process_sheet, self.non_process_df))
+        return sheets
+
+    def __save_xlsx(self):  # keeps the original input sheet with its formatting
+        wb = load_workbook(self.path)
+        wb.worksheets[0].title = self.input_sheet
+        for sheet_name, data_frame in self.__output_sheets():
+            ws = wb.create_sheet(sheet_name)
+            for row in data_frame.itertuples(index=False, name=None):
+                ws.append(row)
+        wb.save(self.path)
+        wb.close()
 
-        with pd.ExcelFile(self.path) as reader:
-            input_df = pd.read_excel(reader, read_wb.sheet_names[0], header=None, keep_default_na=False,
-                                     na_filter=False)
+    def __save_with_pandas(self):
+        with pd.ExcelWriter(self.path, mode='w') as writer:
+            self.input_df.to_excel(writer, self.input_sheet, index=False, header=False)
+            for sheet_name, data_frame in self.__output_sheets():
+                data_frame.to_excel(writer, sheet_name, index=False, header=False)
 
-        if len(input_df.index.values) == 0:
-            self.__wrong_file_exception(message, reason='no_data')
+    def save(self):
         try:
-            self.columns_dict = self.__get_header(input_df)
-        except Exception:
-            self.__wrong_file_exception(message, reason='wrong_headers')
-        return input_df
-
-    def __add_sheets_to_input(self, procces_df, non_process_df, input_df):
-        try:  # append sheets
-            self.__rename_sheet()
-            with pd.ExcelWriter(self.path, mode='a') as writer:
-                if len(procces_df.index) > 1:
-                    procces_df.to_excel(writer, self.process_sheet, index=False, header=False)
-                if len(non_process_df.index) > 1:
-                    non_process_df.to_excel(writer, self.no_process_sheet, index=False, header=False)
-                    self.has_non_processed = True
+            try:
+                if path.splitext(self.path)[-1].lower() != '.xlsx':
+                    raise Exception
+                self.__save_xlsx()
+            except Exception:  # if file is .xls
+                self.__save_with_pandas()
+        except Exception as e:
+            logger.error(self.config.get('error', 'write_input').format(path.basename(self.path)))
+            raise e
 
-        except Exception:
-            try:  # rewrite file
-                with pd.ExcelWriter(self.path, mode='w') as writer:
-                    input_df.to_excel(writer, self.input_sheet, index=False, header=False)
-                    if len(procces_df.index) > 1:
-                        procces_df.to_excel(writer, self.process_sheet, index=False, header=False)
-                    if len(non_process_df.index) > 1:
-                        non_process_df.to_excel(writer, self.no_process_sheet, index=False, header=False)
-                        self.has_non_processed = True
-            except Exception as e:
-                logger.error(self.config.get('error', 'write_input').format(path.basename(self.path)))
-                raise e
+    def _split_rows(self, df_without_header):
+        is_empty = (df_without_header.astype(str).apply(lambda c: c.str.strip()) == '').all(axis=1)
+        rows = df_without_header[~is_empty].copy()  # Skip empty rows
+
+        # Delete all symbols besides number and letter  from Contract and Task number Columns
+        for col_idx in [self.columns_dict['contract_num'], self.columns_dict['contract_num']]:
+            rows[col_idx] = rows[col_idx].astype(str).str.replace('\\W', '', regex=True)
+
+        search_col = self.columns_dict['search_name']
+        has_name = rows[search_col].astype(str).str.strip() != ''
+        no_name_rows = rows[~has_name]
+        rows_conv = no_name_rows.astype(str).apply(lambda c: c.str.lower().str.replace('\\s', '', regex=True))
+        names = self.conditions.search_names(no_name_rows, rows_conv, self.columns_dict)
+        names = names.dropna()
+        rows.loc[names.index, search_col] = names
+        is_processed = has_name | rows.index.isin(names.index)
+        process = list(rows[is_processed].itertuples(index=False, name=None))
+        non_process = list(rows[~is_processed].itertuples(index=False, name=None))
+        return process, non_process
 
     def parse_input(self, message):
         logger.info(self.config.get('info', 'parse_input'))
@@ -109,73 +210,23 @@ class Input:
         if df_without_header.empty:
             self.__wrong_file_exception(message, reason='no_data')
 
-        process = []
-        non_process = []
-        for row_idx, input_row in df_without_header.iterrows():
-            row = input_row.copy()
-            if all(val.strip() == '' for val in row):
-                continue  # Skip empty row
-
-            # Delete all symbols besides number and letter  from Contract and Task number Columns
-            for col_idx in [self.columns_dict['contract_num'], self.columns_dict['contract_num']]:
-                row[col_idx] = sub('\\W', '', row[col_idx])
-
-            row_conv = [sub("\\s|\\n", "", str(val).lower().strip()) for val in row]
-
-            if not pd.isna(row[self.columns_dict['search_name']]) and row[
-                self.columns_dict['search_name']].strip() != '':
-                process.append(tuple(row.values))
-                continue
-
-            for condition in self.config.options('parse_conditions'):
-                if eval(condition, {'r_c': row_conv, 'col': self.columns_dict}):
-                    search_name = eval(self.config.get('parse_conditions', condition), {'r': row, 'col': self.columns_dict})
-                    row[self.columns_dict['search_name']] = search_name
-                    process.append(tuple(row.values))
-                    break
-            else:
-                non_process.append(tuple(row.values))
+        process, non_process = self._split_rows(df_without_header)
 
         process = [self.header] + process
-        procces_df = pd.DataFrame.from_records(process, columns=self.header)
-        search_names = procces_df[self.header[self.columns_dict['search_name']]].tolist()[1:]
+        self.process_df = pd.DataFrame.from_records(process, columns=self.header)
+        search_names = [row[self.columns_dict['search_name']] for row in process[1:]]
         non_process = [self.header] + non_process
-        non_process_df = pd.DataFrame.from_records(non_process, columns=self.header)
-
-        self.__add_sheets_to_input(procces_df, non_process_df, input_df)
+        self.non_process_df = pd.DataFrame.from_records(non_process, columns=self.header)
+        self.has_non_processed = len(non_process) > 1
+        self.input_df = input_df
         return search_names
 
-    def __add_only_status(self, values):
-        wb = load_workbook(self.path)
-        ws = wb.get_sheet_by_name(self.process_sheet)
-        last_col = ws.max_column + 1
-        for row, value in enumerate(values, start=1):
-            ws.cell(row=row, column=last_col, value=value)
-        wb.save(self.path)
-        wb.close()
-
-    def __rewrite_sheets_with_status(self, values):
-        with pd.ExcelFile(self.path) as reader:
-            input_df = pd.read_excel(reader, self.input_sheet, header=None, na_filter=False)
-            procces_df = pd.read_excel(reader, self.process_sheet, header=None, na_filter=False)
-            if self.has_non_processed:
-                non_process_df = pd.read_excel(reader, self.no_process_sheet, header=None, na_filter=False)
-        last_col = len(input_df.columns)
-        procces_df.insert(last_col, column=str(last_col), value=values)
-        with pd.ExcelWriter(self.path, mode='w') as writer:
-            input_df.to_excel(writer, self.input_sheet, index=False, header=False)
-            procces_df.to_excel(writer, self.process_sheet, index=False, header=False)
-            if self.has_non_processed:
-                non_process_df.to_excel(writer, self.no_process_sheet, index=False, header=False)
-
     def add_status_column(self, values):
         logger.info(self.config.get('info', 'add_status'))
         values = [self.config.get('settings', 'status_col')] + values
         try:
-            try:
-                self.__add_only_status(values)
-            except Exception:  # if file is .xls
-                self.__rewrite_sheets_with_status(values)
+            last_col = len(self.process_df.columns)
+            self.process_df.insert(last_col, column=str(last_col), value=values, allow_duplicates=True)
         except Exception as e:
             logger.error(self.config.get('error', 'add_status').format(path.basename(self.path)))
             raise e
@@ -183,16 +234,119 @@ class Input:
 
 class Output:
 
-    def __init__(self, config):
+    def __init__(self, config, temp_dir=None):
         self.config = config
-        self.path = path.join(config.get('path', 'temp'), config.get('settings', 'output_file').format(
+        self.format = config.get('settings', 'output_format', fallback='xlsx')
+        self.streaming = self.format != 'xlsx'
+        self.path = path.join(temp_dir or config.get('path', 'temp'), config.get('settings', 'output_file').format(
             datetime.now().strftime(config.get('settings', 'file_date_format'))))
+        if self.format in ('csv', 'parquet'):
+            self.path = '{0}.{1}'.format(path.splitext(self.path)[0], self.format)
+        self.rows = 0
+        self._sink = None
+        self._lock = threading.Lock()
 
     def write(self, data_frame):
         logger.info(self.config.get('info', 'write_output'))
         try:
             with pd.ExcelWriter(self.path) as writer:
                 data_frame.to_excel(writer, self.config.get('settings', 'output_sheet'), index=False, header=True)
+            self.rows = len(data_frame.index)
+            metrics.count('output_rows', self.rows, format=self.format)
+        except Exception as e:
+            logger.error(self.config.get('error', 'write_output').format(path.basename(self.path)))
+            raise e
+
+    def open(self, columns, bool_columns=()):
+        logger.info(self.config.get('info', 'write_output'))
+        try:
+            if not path.exists(path.dirname(self.path)):
+                makedirs(path.dirname(self.path))
+            if self.format == 'xlsx_stream':
+                self._sink = _XlsxSink(self.path, self.config.get('settings', 'output_sheet'), columns)
+            elif self.format == 'csv':
+                self._sink = _CsvSink(self.path, columns)
+            elif self.format == 'parquet':
+                self._sink = _ParquetSink(self.path, columns, bool_columns,
+                                          self.config.getint('settings', 'output_batch', fallback=1000))
+            else:
+                raise ValueError(self.format)
+        except Exception as e:
+            logger.error(self.config.get('error', 'write_output').format(path.basename(self.path)))
+            raise e
+
+    def append(self, row):
+        with self._lock:
+            self._sink.append(row)
+            self.rows += 1
+        metrics.count('output_rows', format=self.format)
+
+    def close(self):
+        if self._sink is None:
+            return
+        try:
+            with self._lock:
+                self._sink.close()
+                self._sink = None
         except Exception as e:
             logger.error(self.config.get('error', 'write_output').format(path.basename(self.path)))
             raise e
+
+
+class _XlsxSink:
+
+    def __init__(self, file_path, sheet_name, columns):
+        self.path = file_path
+        self.wb = Workbook(write_only=True)  # rows are flushed to a temp file, memory stays flat
+        self.ws = self.wb.create_sheet(sheet_name)
+        self.ws.append(columns)
+
+    def append(self, row):
+        self.ws.append(row)
+
+    def close(self):
+        self.wb.save(self.path)
+        self.wb.close()
+
+
+class _CsvSink:
+
+    def __init__(self, file_path, columns):
+        self.file = open(file_path, 'w', newline='', encoding='utf-8-sig')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(columns)
+
+    def append(self, row):
+        self.writer.writerow(row)
+
+    def close(self):
+        self.file.close()
+
+
+class _ParquetSink:
+
+    def __init__(self, file_path, columns, bool_columns, batch_size):
+        import pyarrow
+        import pyarrow.parquet
+        self.pa = pyarrow
+        self.columns = columns
+        self.batch_size = batch_size
+        self.schema = pyarrow.schema([(k, pyarrow.bool_() if k in bool_columns else pyarrow.string()) for k in columns])
+        self.writer = pyarrow.parquet.ParquetWriter(file_path, self.schema)
+        self.batch = []
+
+    def _flush(self):
+        if self.batch:
+            arrays = [self.pa.array(list(values), type=field.type)
+                      for values, field in zip(zip(*self.batch), self.schema)]
+            self.writer.write_table(self.pa.Table.from_arrays(arrays, schema=self.schema))
+            self.batch = []
+
+    def append(self, row):
+        self.batch.append(row)
+        if len(self.batch) >= self.batch_size:
+            self._flush()
+
+    def close(self):
+        self._flush()
+        self.writer.close()
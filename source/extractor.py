@@ -0,0 +1,70 @@
+from bs4 import BeautifulSoup
+
+try:
+    from lxml import etree, html as lxml_html
+except ImportError:
+    lxml_html = None
+
+
+class FormExtractor:
+
+    def __init__(self, form_tags):
+        self._form_tags = dict(form_tags)  # {tag_id: tag_type} from map_output.json
+        if lxml_html is not None:
+            self._id_index = etree.XPath('//*[@id]')
+            self._selected_option = etree.XPath(
+                "(descendant::option[@selected='true'] | following::option[@selected='true'])[1]")
+
+    def _root(self, page):
+        try:
+            return lxml_html.document_fromstring(page)
+        except ValueError:  # unicode page with encoding declaration
+            return lxml_html.document_fromstring(page.encode('utf-8'))
+
+    def _extract_lxml(self, page):
+        tags = {}
+        for tag in self._id_index(self._root(page)):
+            tag_id = tag.get('id')
+            if tag_id in self._form_tags and tag_id not in tags:
+                tags[tag_id] = tag
+        result = dict.fromkeys(self._form_tags)
+        for k, tag in tags.items():
+            v = self._form_tags[k]
+            if v == 'input':
+                result[k] = tag.get('value')
+            elif v == 'checkbox':
+                result[k] = tag.get('checked') is not None
+            elif v == 'td' or v == 'text':
+                result[k] = str(tag.text_content())  # smart strings keep their whole parsed tree alive
+            elif v == 'select':
+                option = self._selected_option(tag)
+                if option:
+                    result[k] = str(option[0].text_content())
+        return result
+
+    def _extract_soup(self, page):
+        soup = BeautifulSoup(page, features='html.parser')
+        tags = {}
+        for tag in soup.find_all(id=True):
+            tag_id = tag.attrs['id']
+            if tag_id in self._form_tags and tag_id not in tags:
+                tags[tag_id] = tag
+        result = dict.fromkeys(self._form_tags)
+        for k, tag in tags.items():
+            v = self._form_tags[k]
+            if v == 'input':
+                result[k] = tag.attrs.get('value')
+            elif v == 'checkbox':
+                result[k] = tag.attrs.get('checked') is not None
+            elif v == 'td' or v == 'text':
+                result[k] = tag.text
+            elif v == 'select':
+                option = tag.find_next('option', {'selected': 'true'})
+                if option:
+                    result[k] = option.text
+        return result
+
+    def extract(self, page):
+        if lxml_html is not None:
+            return self._extract_lxml(page)
+        return self._extract_soup(page)
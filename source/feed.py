@@ -0,0 +1,95 @@
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from io import BytesIO
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+_ATOM = '{http://www.w3.org/2005/Atom}'
+# View href parameters of the award -> paths of the same values in award and IDV records
+_IDENTITY = (('agencyID', ('awardID/awardContractID/agencyID', 'contractID/IDVID/agencyID')),
+             ('PIID', ('awardID/awardContractID/PIID', 'contractID/IDVID/PIID')),
+             ('modNumber', ('awardID/awardContractID/modNumber', 'contractID/IDVID/modNumber')),
+             ('idvAgencyID', ('awardID/referencedIDVID/agencyID', 'contractID/referencedIDVID/agencyID')),
+             ('idvPIID', ('awardID/referencedIDVID/PIID', 'contractID/referencedIDVID/PIID')))
+
+
+class FeedParser:
+    # ezsearch ATOM pages -> the same fields FormExtractor takes from the award forms (keyed by the form tag
+    # ids of map_output.json), so rows, cache, journal and award store don't depend on the backend
+
+    def __init__(self, atom_map):
+        self._paths = {tag_id: (value[0], value[1], value[2] if len(value) > 2 else ())
+                       for tag_id, value in atom_map.items()}
+
+    @staticmethod
+    def _elements(record):
+        # {'awardID/awardContractID/PIID': element}, the first element of every path
+        elements = {}
+        stack = [(child, etree.QName(child).localname) for child in reversed(record) if isinstance(child.tag, str)]
+        while stack:
+            element, path = stack.pop()
+            elements.setdefault(path, element)
+            stack.extend((child, '{0}/{1}'.format(path, etree.QName(child).localname))
+                         for child in reversed(element) if isinstance(child.tag, str))
+        return elements
+
+    @staticmethod
+    def _value(element, kind, true_values):
+        if element is None:
+            return None
+        text = (element.text or '').strip()
+        if kind in ('name', 'description'):
+            return element.get(kind)
+        elif kind == 'code_description':
+            return '{0}: {1}'.format(text, element.get('description')) if text else ''
+        elif kind == 'date':  # 2019-08-15 00:00:00 -> 08/15/2019 as on the form
+            return datetime.strptime(text[:10], '%Y-%m-%d').strftime('%m/%d/%Y') if text else ''
+        elif kind == 'money':  # 1234567.00 -> $1,234,567.00
+            try:
+                amount = Decimal(text)
+            except InvalidOperation:  # empty or malformed amount, the rest of the entry is still read
+                return ''
+            if not amount.is_finite():
+                return ''
+            return '{0}${1:,.2f}'.format('-' if amount < 0 else '', abs(amount))
+        elif kind == 'flag':
+            return text in true_values
+        return text
+
+    def _entry(self, entry):
+        content = entry.find(_ATOM + 'content')
+        records = [child for child in content if isinstance(child.tag, str)] if content is not None else []
+        if not records:
+            return None
+        elements = self._elements(records[0])
+        identity = []
+        for name, paths in _IDENTITY:
+            for path in paths:
+                if path in elements and elements[path].text:
+                    identity.append((name, elements[path].text.strip()))
+                    break
+        fields = {tag_id: self._value(elements.get(path), kind, true_values)
+                  for tag_id, (path, kind, true_values) in self._paths.items()}
+        return identity, fields
+
+    def parse(self, body):
+        # Returns [(award identity, fields)] and href of the next page (None on the last one);
+        # entries are dropped as soon as they are read, a page never stays in memory as a whole tree
+        entries = []
+        next_href = None
+        for event, element in etree.iterparse(BytesIO(body), events=('end',), tag=(_ATOM + 'entry', _ATOM + 'link'),
+                                              resolve_entities=False, no_network=True):
+            if element.tag == _ATOM + 'link':
+                if element.get('rel') == 'next' and element.getparent().tag == _ATOM + 'feed':
+                    next_href = element.get('href')
+                continue
+            entry = self._entry(element)
+            if entry is not None:
+                entries.append(entry)
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+        return entries, next_href
@@ -0,0 +1,135 @@
+import asyncio
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from source.metrics import metrics
+
+
+def _sizeof(value):
+    # Results are json like: dicts, lists and strings
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_sizeof(key) + _sizeof(item) for key, item in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(_sizeof(item) for item in value)
+    return size
+
+
+class _LeaderCancelled(Exception):
+    pass
+
+
+class SingleFlight:
+    # Fetch and parse of one page shared by everything in the process: concurrent calls with the same key (jobs
+    # with overlapping search names, "X IDV" and "X FSS" reaching the same awards) wait for the one in flight,
+    # and its parsed result is kept for ttl seconds in a LRU of at most max_mb. Results are shared, callers
+    # don't change them. Futures are concurrent ones, the jobs' event loops wait for them with wrap_future
+
+    def __init__(self, config):
+        self.enabled = config.getboolean('flights', 'enabled', fallback=True)
+        self.max_bytes = config.getfloat('flights', 'max_mb', fallback=64) * 2 ** 20
+        self.ttl = config.getfloat('flights', 'ttl_seconds', fallback=600)
+        self._flights = {}  # key -> Future of the call in flight
+        self._results = OrderedDict()  # key -> (result, size, stored), least recently used first
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _join(self, key, cached):
+        # -> ('hit', result), ('shared', future) or ('leader', future)
+        with self._lock:
+            entry = self._results.get(key) if cached else None
+            if entry is not None and time.monotonic() - entry[2] >= self.ttl:
+                self._discard(key)
+                entry = None
+            if entry is not None:
+                self._results.move_to_end(key)
+                state = 'hit', entry[0]
+            elif key in self._flights:
+                state = 'shared', self._flights[key]
+            else:
+                state = 'leader', self._flights.setdefault(key, Future())
+        metrics.count('flights', result=state[0])
+        return state
+
+    def _discard(self, key):
+        result, size, stored = self._results.pop(key)
+        self._bytes -= size
+
+    def _land(self, key, future, result=None, exception=None):
+        with self._lock:
+            del self._flights[key]
+            if exception is None:
+                size = _sizeof(result)
+                if key in self._results:
+                    self._discard(key)
+                if size <= self.max_bytes:
+                    self._results[key] = (result, size, time.monotonic())
+                    self._bytes += size
+                while self._bytes > self.max_bytes:
+                    self._discard(next(iter(self._results)))
+        if exception is None:
+            future.set_result(result)
+        else:
+            future.set_exception(exception)
+
+    @staticmethod
+    def _shared_exception(exception):
+        # A cancelled leader must not fail the waiting tasks of other jobs: they fetch the page themselves
+        return exception if isinstance(exception, Exception) else _LeaderCancelled()
+
+    def do(self, key, function, cached=True):
+        if not self.enabled:
+            return function()
+        state, value = self._join(key, cached)
+        while state == 'shared':
+            try:
+                return value.result()
+            except _LeaderCancelled:
+                state, value = self._join(key, cached)
+        if state == 'hit':
+            return value
+        try:
+            result = function()
+        except BaseException as exception:
+            self._land(key, value, exception=self._shared_exception(exception))
+            raise
+        self._land(key, value, result)
+        return result
+
+    async def do_async(self, key, function, cached=True):
+        if not self.enabled:
+            return await function()
+        state, value = self._join(key, cached)
+        while state == 'shared':
+            try:
+                return await asyncio.wrap_future(value)
+            except _LeaderCancelled:
+                state, value = self._join(key, cached)
+        if state == 'hit':
+            return value
+        try:
+            result = await function()
+        except BaseException as exception:
+            self._land(key, value, exception=self._shared_exception(exception))
+            raise
+        self._land(key, value, result)
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            self._bytes = 0
+
+
+_page_flights = None
+_page_flights_lock = threading.Lock()
+
+
+def page_flights(config):
+    global _page_flights
+    with _page_flights_lock:
+        if _page_flights is None:
+            _page_flights = SingleFlight(config)
+    return _page_flights
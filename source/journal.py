@@ -0,0 +1,126 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Journal:
+
+    def __init__(self, config, search_names, job=''):
+        self.config = config
+        self.enabled = config.getboolean('journal', 'enabled', fallback=True)
+        self.max_age = config.getfloat('journal', 'max_age_hours', fallback=24) * 3600
+        self.fsync = config.getboolean('journal', 'fsync', fallback=False)
+        # job - id of the letter: its rerun resumes, other letters with the same search names don't
+        run_key = hashlib.sha256('\n'.join([job] + sorted(set(search_names))).encode('utf-8')).hexdigest()
+        self.path = os.path.join(config.get('path', 'journal'), '{0}.jsonl'.format(run_key))
+        self.searches = {}  # search name -> (found, pagination hrefs, form hrefs)
+        self.pages = {}  # pagination href -> form hrefs
+        self.page_links = {}  # pagination href -> next pages found on it (ATOM feed)
+        self.forms = {}  # form href -> fields
+        self.created = None
+        self._writer = None
+        self._lock = threading.Lock()
+        self._cut_line = False
+
+    def _read(self):
+        with open(self.path, 'r', encoding='utf-8') as reader:
+            for line in reader:
+                self._cut_line = not line.endswith('\n')
+                try:
+                    record = json.loads(line)
+                except ValueError:  # line cut by the crash of the previous run
+                    continue
+                if record['type'] == 'run':
+                    self.created = record['created']
+                elif record['type'] == 'search':
+                    self.searches[record['name']] = (record['found'], record['pagination'], record['forms'])
+                elif record['type'] == 'page':
+                    self.pages[record['href']] = record['forms']
+                    self.page_links[record['href']] = record.get('pagination', [])
+                elif record['type'] == 'form':
+                    self.forms[record['href']] = record['fields']
+
+    def _remove_expired(self):
+        # Journals of runs which crashed long ago: their rows are stale, the letter was answered or is lost
+        folder = os.path.dirname(self.path)
+        for name in os.listdir(folder):
+            path = os.path.join(folder, name)
+            try:
+                if name.endswith('.jsonl') and path != self.path and \
+                        time.time() - os.path.getmtime(path) > self.max_age:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def _reset(self):
+        self.searches, self.pages, self.page_links, self.forms = {}, {}, {}, {}
+        self.created = None
+        self._cut_line = False
+        os.remove(self.path)
+
+    def open(self):
+        if not self.enabled:
+            return self
+        if not os.path.exists(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+        self._remove_expired()
+        if os.path.isfile(self.path):
+            self._read()
+            created = self.created if self.created is not None else os.path.getmtime(self.path)
+            if time.time() - created > self.max_age:
+                logger.warning(self.config.get('warning', 'journal_expired').format(self.path))
+                self._reset()
+            else:
+                logger.info(self.config.get('info', 'journal_resume').format(
+                    self.path, len(self.searches), len(self.pages), len(self.forms)))
+        self._writer = open(self.path, 'a', encoding='utf-8')
+        if self._cut_line:
+            self._writer.write('\n')
+        if self.created is None:
+            self.created = time.time()
+            self._write({'type': 'run', 'created': self.created})
+        return self
+
+    def pending_pages(self):
+        hrefs = [href for found, pagination, forms in self.searches.values() for href in pagination]
+        hrefs.extend(href for pagination in self.page_links.values() for href in pagination)
+        return [href for href in hrefs if href not in self.pages]
+
+    def pending_forms(self):
+        hrefs = [href for found, pagination, forms in self.searches.values() for href in forms]
+        hrefs.extend(href for forms in self.pages.values() for href in forms)
+        return [href for href in hrefs if href not in self.forms]
+
+    def _write(self, record):
+        if self._writer is None:
+            return
+        with self._lock:
+            self._writer.write(json.dumps(record) + '\n')
+            self._writer.flush()
+            if self.fsync:
+                os.fsync(self._writer.fileno())
+
+    def search(self, name, found, pagination, forms):
+        self._write({'type': 'search', 'name': name, 'found': found, 'pagination': pagination, 'forms': forms})
+
+    def page(self, href, forms, pagination=()):
+        record = {'type': 'page', 'href': href, 'forms': forms}
+        if pagination:
+            record['pagination'] = list(pagination)
+        self._write(record)
+
+    def form(self, href, fields):
+        self._write({'type': 'form', 'href': href, 'fields': fields})
+
+    def close(self, completed):
+        if self._writer is None:
+            return
+        self._writer.close()
+        self._writer = None
+        if completed:
+            os.remove(self.path)
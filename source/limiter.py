@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+logger = logging.getLogger(__name__)
+
+
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except Exception:
+        return None
+
+
+class AdaptiveLimiter:
+
+    def __init__(self, config):
+        self.config = config
+        self.enabled = config.getboolean('limiter', 'enabled', fallback=True)
+        self.max_limit = config.getint('limiter', 'max_concurrency', fallback=config.getint('settings', 'pool'))
+        self.min_limit = min(config.getint('limiter', 'min_concurrency', fallback=1), self.max_limit)
+        self.limit = min(config.getint('limiter', 'initial_concurrency', fallback=self.max_limit), self.max_limit)
+        self.latency_target = config.getfloat('limiter', 'latency_target', fallback=10)
+        self.decrease_factor = config.getfloat('limiter', 'decrease_factor', fallback=0.5)
+        self.log_interval = config.getfloat('limiter', 'log_interval', fallback=30)
+        self.in_flight = 0
+        self._limit = float(self.limit)
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._requests = 0
+        self._throttled = 0
+        self._last_log = time.monotonic()
+        self._condition = threading.Condition()
+
+    def _try_acquire(self, now):
+        if self.in_flight < self.limit and now >= self._paused_until:
+            self.in_flight += 1
+            return True
+        return False
+
+    def acquire(self):
+        if not self.enabled:
+            return time.monotonic()
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                if self._try_acquire(now):
+                    return now
+                self._condition.wait(max(0.05, self._paused_until - now))
+
+    async def acquire_async(self):
+        if not self.enabled:
+            return time.monotonic()
+        while True:
+            with self._condition:
+                now = time.monotonic()
+                if self._try_acquire(now):
+                    return now
+                delay = max(0.05, self._paused_until - now)
+            await asyncio.sleep(delay)
+
+    def _decrease(self, now):
+        # One decrease per latency target, so a burst of failed in-flight requests halves the limit only once
+        if now - self._last_decrease < self.latency_target:
+            return
+        self._last_decrease = now
+        self._limit = max(self.min_limit, self._limit * self.decrease_factor)
+
+    def release(self, started, status=None, retry_after=None):
+        if not self.enabled:
+            return
+        with self._condition:
+            now = time.monotonic()
+            self.in_flight -= 1
+            self._requests += 1
+            if status is None or status == 429 or status >= 500:
+                self._throttled += 1
+                self._decrease(now)
+            elif now - started > self.latency_target:
+                self._decrease(now)
+            else:
+                self._limit = min(self.max_limit, self._limit + 1 / self._limit)  # +1 per window of limit requests
+            if retry_after:
+                self._paused_until = max(self._paused_until, now + retry_after)
+            self.limit = int(self._limit)
+            self._condition.notify_all()
+            if now - self._last_log >= self.log_interval:
+                logger.info(self.config.get('info', 'limiter_state').format(
+                    self.limit, self.in_flight, self._requests / (now - self._last_log), self._throttled))
+                self._last_log = now
+                self._requests = 0
+                self._throttled = 0
@@ -0,0 +1,213 @@
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from source.tools import retry_stats
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+PHASE_BUCKETS = (0.1, 1, 5, 10, 30, 60, 300, 600, 1800, 3600)
+
+
+class _Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def cumulative(self):
+        total = 0
+        for le, count in zip(list(self.buckets) + ['+Inf'], self.counts):
+            total += count
+            yield le, total
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the quantile, the max for the +Inf bucket
+        rank = q * self.count
+        for le, total in self.cumulative():
+            if total >= rank:
+                return round(self.max if le == '+Inf' else min(le, self.max), 3)
+        return round(self.max, 3)
+
+    def report(self):
+        return {'count': self.count, 'sum': round(self.sum, 3), 'max': round(self.max, 3),
+                'mean': round(self.sum / self.count, 3) if self.count else 0,
+                'p50': self.quantile(0.5), 'p95': self.quantile(0.95), 'p99': self.quantile(0.99)}
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def _label_text(labels, extra=()):
+    labels = list(labels) + list(extra)
+    return '{' + ','.join('{0}="{1}"'.format(k, v) for k, v in labels) + '}' if labels else ''
+
+
+class Metrics:
+    # Process wide, like retry_stats: jobs of batch and daemon modes add to the same counters
+
+    def __init__(self):
+        self.config = None
+        self.enabled = True
+        self.started = time.time()
+        self.report_path = None
+        self.textfile = None
+        self.progress_interval = 10
+        self._counters = defaultdict(float)  # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> _Histogram
+        self._progress = {}  # stage -> time of the last event
+        self._lock = threading.Lock()
+        self._exporter = None
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self._counters.clear()
+            self._histograms.clear()
+            self._progress.clear()
+
+    def configure(self, config):
+        self.config = config
+        self.enabled = config.getboolean('metrics', 'enabled', fallback=True)
+        self.report_path = os.path.join(config.get('path', 'metrics'), 'run_{0}.json'.format(
+            datetime.fromtimestamp(self.started).strftime('%Y%m%d_%H%M%S')))
+        self.textfile = config.get('metrics', 'prometheus_textfile', fallback='') or None
+        self.progress_interval = config.getfloat('metrics', 'progress_interval', fallback=10)
+        port = config.getint('metrics', 'exporter_port', fallback=0)
+        if self.enabled and port and self._exporter is None:
+            self._start_exporter(port)
+
+    def count(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[_key(name, labels)] += value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        if not self.enabled:
+            return
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('phase_seconds', time.perf_counter() - started, buckets=PHASE_BUCKETS, phase=name)
+
+    def progress(self, stage, done, total, final=False):
+        # Structured progress event (one JSON log line) per stage every progress_interval seconds
+        now = time.monotonic()
+        with self._lock:
+            if not final and now - self._progress.get(stage, 0) < self.progress_interval:
+                return
+            self._progress[stage] = now
+        logger.info(json.dumps({'event': 'progress', 'stage': stage, 'done': done, 'total': total,
+                                'final': final}))
+
+    def _counter(self, name):
+        return sum(value for (counter, labels), value in self._counters.items() if counter == name)
+
+    def _phase_seconds(self, name):
+        histogram = self._histograms.get(_key('phase_seconds', {'phase': name}))
+        return histogram.sum if histogram else 0
+
+    def report(self):
+        with self._lock:
+            counters = {}
+            for (name, labels), value in sorted(self._counters.items()):
+                counters.setdefault(name, {})[','.join('{0}={1}'.format(k, v) for k, v in labels) or 'all'] = value
+            histograms = {}
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                label = ','.join('{0}={1}'.format(k, v) for k, v in labels) or 'all'
+                histograms.setdefault(name, {})[label] = histogram.report()
+            hits, misses = self._counter('cache_hits'), self._counter('cache_misses')
+            scrape_seconds = self._phase_seconds('scrape')
+            forms = self._counter('forms')
+        return {'started': datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+                'seconds': round(time.time() - self.started, 3),
+                'phases': histograms.pop('phase_seconds', {}),
+                'histograms': histograms,
+                'counters': counters,
+                'retries': {name: dict(stats) for name, stats in retry_stats.items()},
+                'cache_hit_rate': round(hits / (hits + misses), 4) if hits + misses else None,
+                'forms_per_second': round(forms / scrape_seconds, 2) if scrape_seconds else None}
+
+    def prometheus(self):
+        lines = []
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                lines.append('fpds_bot_{0}_total{1} {2}'.format(name, _label_text(labels), value))
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                for le, total in histogram.cumulative():
+                    lines.append('fpds_bot_{0}_bucket{1} {2}'.format(name, _label_text(labels, [('le', le)]), total))
+                lines.append('fpds_bot_{0}_sum{1} {2}'.format(name, _label_text(labels), histogram.sum))
+                lines.append('fpds_bot_{0}_count{1} {2}'.format(name, _label_text(labels), histogram.count))
+        for name, stats in sorted(retry_stats.items()):
+            for event, value in sorted(stats.items()):
+                lines.append('fpds_bot_retry_{0}_total{{function="{1}"}} {2}'.format(event, name, value))
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _write_file(file_path, text):
+        if not os.path.exists(os.path.dirname(file_path)):
+            os.makedirs(os.path.dirname(file_path))
+        temp_path = '{0}.tmp'.format(file_path)  # readers never see a half written file
+        with open(temp_path, 'w', encoding='utf-8') as writer:
+            writer.write(text)
+        os.replace(temp_path, file_path)
+
+    def write(self):
+        if not self.enabled or self.report_path is None:
+            return
+        try:
+            self._write_file(self.report_path, json.dumps(self.report(), indent=2))
+            if self.textfile:
+                self._write_file(self.textfile, self.prometheus())
+        except Exception:
+            logger.warning(self.config.get('warning', 'metrics_report').format(self.report_path), exc_info=True)
+
+    def _start_exporter(self, port):
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                body = registry.prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._exporter = ThreadingHTTPServer(('', port), Handler)
+        threading.Thread(target=self._exporter.serve_forever, name='metrics_exporter', daemon=True).start()
+
+
+metrics = Metrics()
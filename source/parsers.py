@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+from source.extractor import FormExtractor
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+_extractor = None  # FormExtractor of a parser process
+
+
+def _init_worker(form_tags):
+    global _extractor
+    _extractor = FormExtractor(form_tags)
+
+
+def _extract_page(page):
+    # ('ok', field values in form_tags order) or ('error', exception type, message): lxml exceptions don't
+    # pickle, and one bad page must not fail the other pages of its batch
+    try:
+        return 'ok', tuple(_extractor.extract(page).values())
+    except Exception as exception:
+        return 'error', type(exception).__name__, str(exception)
+
+
+def _extract_batch(pages):
+    return [_extract_page(page) for page in pages]
+
+
+class ParserPool:
+    # Award form extraction in processes: scrapping threads / event loop only download pages and the parsing
+    # doesn't hold their GIL. Pages are sent by batches of batch_size (or what came in batch_wait seconds),
+    # fields come back as tuples. workers = 0 - extraction in the calling thread
+
+    def __init__(self, config, form_tags):
+        self.config = config
+        self.workers = config.getint('parsers', 'workers', fallback=0)
+        self.batch_size = config.getint('parsers', 'batch_size', fallback=8)
+        self.batch_wait = config.getfloat('parsers', 'batch_wait', fallback=0.01)
+        self._form_tags = dict(form_tags)
+        self._tags = list(self._form_tags)
+        self._extractor = None
+        self._executor = None
+        self._queue = queue.Queue()
+        self._batcher = None
+
+    def open(self):
+        if self.workers <= 0:
+            self._extractor = FormExtractor(self._form_tags)
+            return self
+        # spawn: forking a process with running scrapping threads can copy their held locks
+        self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                             initializer=_init_worker, initargs=(self._form_tags,))
+        self._batcher = threading.Thread(target=self._batch_pages, name='parser_batcher', daemon=True)
+        self._batcher.start()
+        logger.info(self.config.get('info', 'parser_pool').format(self.workers, self.batch_size))
+        return self
+
+    def submit(self, page):
+        future = Future()
+        if self._executor is None:
+            try:
+                future.set_result(self._extractor.extract(page))
+            except Exception as exception:
+                future.set_exception(exception)
+        else:
+            self._queue.put((page, future))
+        return future
+
+    def extract(self, page):
+        return self.submit(page).result()
+
+    async def extract_async(self, page):
+        return await asyncio.wrap_future(self.submit(page))
+
+    def _batch_pages(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.batch_wait
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            futures = [future for page, future in batch]
+            try:
+                task = self._executor.submit(_extract_batch, [page for page, future in batch])
+            except Exception as exception:
+                for future in futures:
+                    future.set_exception(exception)
+            else:
+                task.add_done_callback(partial(self._resolve, futures))
+
+    def _resolve(self, futures, task):
+        exception = task.exception()
+        if exception is not None:
+            for future in futures:
+                future.set_exception(exception)
+            return
+        for future, outcome in zip(futures, task.result()):
+            if outcome[0] == 'ok':
+                future.set_result(dict(zip(self._tags, outcome[1])))
+            else:
+                future.set_exception(Exception('{0}: {1}'.format(*outcome[1:])))
+
+    def close(self):
+        if self._executor is None:
+            return
+        self._queue.put(_STOP)
+        self._batcher.join()
+        self._executor.shutdown()
+        self._executor = None
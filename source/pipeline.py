@@ -0,0 +1,140 @@
+import asyncio
+import queue
+import threading
+import time
+from source.metrics import metrics
+
+_STOP = object()
+
+
+class Stage:
+
+    def __init__(self, name, handler, workers, queue_size):
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self.queue = None
+        self.total = 0
+        self.done = 0
+
+
+class _Pipeline:
+
+    def __init__(self, stages):
+        self.stages = {stage.name: stage for stage in stages}
+        self._order = [stage.name for stage in stages]
+        self._lock = threading.Lock()
+        self.error = None
+
+    def _close_progress(self):
+        for stage in self.stages.values():
+            metrics.progress(stage.name, stage.done, stage.total, final=True)
+
+    def _count_put(self, stage):
+        with self._lock:
+            stage.total += 1
+
+    def _count_done(self, stage, started):
+        metrics.observe('stage_seconds', time.perf_counter() - started, stage=stage.name)
+        with self._lock:
+            stage.done += 1
+        metrics.progress(stage.name, stage.done, stage.total)
+
+    def _set_error(self, exception):
+        with self._lock:
+            if self.error is None:
+                self.error = exception
+
+
+class ThreadPipeline(_Pipeline):
+
+    def put(self, name, item):
+        stage = self.stages[name]
+        self._count_put(stage)
+        stage.queue.put(item)
+
+    def _worker(self, stage):
+        while True:
+            item = stage.queue.get()
+            if item is _STOP:
+                stage.queue.task_done()
+                return
+            started = time.perf_counter()
+            try:
+                if self.error is None:
+                    stage.handler(item)
+            except Exception as exception:
+                self._set_error(exception)
+            finally:
+                self._count_done(stage, started)
+                stage.queue.task_done()
+
+    def run(self, items, seeds=None):
+        threads = []
+        for stage in self.stages.values():
+            stage.queue = queue.Queue(stage.queue_size)
+            for _ in range(stage.workers):
+                thread = threading.Thread(target=self._worker, args=(stage,), daemon=True)
+                thread.start()
+                threads.append(thread)
+        try:
+            for item in items:
+                self.put(self._order[0], item)
+            for name, stage_items in (seeds or {}).items():  # items of a resumed run
+                for item in stage_items:
+                    self.put(name, item)
+            for name in self._order:  # every stage only feeds the stages after it
+                self.stages[name].queue.join()
+        finally:
+            for stage in self.stages.values():
+                for _ in range(stage.workers):
+                    stage.queue.put(_STOP)
+            for thread in threads:
+                thread.join()
+            self._close_progress()
+        if self.error is not None:
+            raise self.error
+
+
+class AsyncPipeline(_Pipeline):
+
+    async def put(self, name, item):
+        stage = self.stages[name]
+        self._count_put(stage)
+        await stage.queue.put(item)
+
+    async def _worker(self, stage):
+        while True:
+            item = await stage.queue.get()
+            started = time.perf_counter()
+            try:
+                if self.error is None:
+                    await stage.handler(item)
+            except Exception as exception:
+                self._set_error(exception)
+            finally:
+                self._count_done(stage, started)
+                stage.queue.task_done()
+
+    async def run(self, items, seeds=None):
+        tasks = []
+        for stage in self.stages.values():
+            stage.queue = asyncio.Queue(stage.queue_size)
+            tasks.extend(asyncio.ensure_future(self._worker(stage)) for _ in range(stage.workers))
+        try:
+            for item in items:
+                await self.put(self._order[0], item)
+            for name, stage_items in (seeds or {}).items():
+                for item in stage_items:
+                    await self.put(name, item)
+            for name in self._order:
+                await self.stages[name].queue.join()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self._close_progress()
+        if self.error is not None:
+            raise self.error
+
@@ -1,28 +1,99 @@
+import asyncio
+import hashlib
+import json
 import logging
-from multiprocessing.pool import ThreadPool
-from urllib.parse import urlencode, urljoin
+import re
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit, urlunsplit
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
-import tqdm
-from source.tools import retry
+from source.awards import AwardStore
+from source.cache import FormCache
+from source.collector import ResultCollector
+from source.feed import FeedParser, etree
+from source.flights import page_flights
+from source.journal import Journal
+from source.limiter import AdaptiveLimiter, parse_retry_after
+from source.metrics import metrics
+from source.parsers import ParserPool
+from source.pipeline import Stage, ThreadPipeline, AsyncPipeline
+from source.tools import RetryBudget, get_output_map, retry
+from source.workqueue import make_work_queue
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
 
 
 logger = logging.getLogger(__name__)
+_DATE = re.compile('\\b\\d{2}/\\d{2}/\\d{4}\\b')
+
+
+class FpdsConnectionError(Exception):
+    pass
+
+
+class FpdsResponseError(Exception):
+
+    def __init__(self, status, retry_after=None):
+        super().__init__(status)
+        self.status = status
+        self.retry_after = retry_after
 
 
 class Scrapper:
 
-    def __init__(self, config, mapping):
+    def __init__(self, config, mapping, limiter=None, output=None):
         self.config = config
         self._mapping = mapping
         self._mapping_form_tags = None
+        self._parsers = None
+        self._feed = None
+        self._backend = config.get('settings', 'backend', fallback='html')
+        self._feed_href = config.get('settings', 'feed_HREF', fallback='')
         self._pool = config.getint('settings', 'pool')
+        self._engine = config.get('settings', 'engine', fallback='thread')
+        self._concurrency = config.getint('settings', 'concurrency', fallback=self._pool)
+        self._connections_per_host = config.getint('settings', 'connections_per_host', fallback=self._concurrency)
+        self._timeout = config.getint('settings', 'request_timeout', fallback=60)
+        self._search_workers = config.getint('settings', 'search_workers', fallback=self._pool)
+        self._pagination_workers = config.getint('settings', 'pagination_workers', fallback=self._pool)
+        self._form_workers = config.getint('settings', 'form_workers', fallback=self._pool)
+        self._queue_size = config.getint('settings', 'queue_size', fallback=0)
+        self._limiter = limiter or AdaptiveLimiter(config)
+        self._budget = RetryBudget(config)
+        self._run_budgets = OrderedDict()  # worker.py: run id -> (RetryBudget, last used) of coordinators' runs
+        self._run_budgets_lock = threading.Lock()
+        self._thread = threading.local()  # worker.py: budget of the run whose item the thread works on
+        self._session = None
+        self._pipeline = None
         self._search_names = []
+        self._searched_names = set()
         self.success_names = []
-        self._pagination_hrefs = []
-        self._form_hrefs = []
-        self._forms = []
+        self._forms = None
+        self._award_names = {}  # canonical form href -> search names which reached it
+        self._page_names = {}  # pagination href -> search name
+        self._awards_lock = threading.Lock()
+        self._link_column = config.get('settings', 'link_column', fallback='')
+        self._output = output if output is not None and output.streaming else None
+        self._cache = FormCache(config)
+        self._store = AwardStore(config)
+        self._flights = page_flights(config)
+        self._form_meta = {}  # form href -> hash of its search result row, incremental mode only
+        self._journal = None
+        self._queue = make_work_queue(config) if config.getboolean('queue', 'enabled', fallback=False) else None
+        self._poll_interval = config.getfloat('queue', 'poll_interval', fallback=0.5)
+        self._stall_timeout = config.getfloat('queue', 'stall_timeout', fallback=1800)
+        self._run_id = None
+        self._published = {}  # work item kind -> items published by this run
+        self._collected = {}
+        self._worker = False  # Scrapper of worker.py: fetches and parses work items of the coordinators
         self.forms_df = pd.DataFrame(columns=mapping.keys())
         self._soup_parser = None
         self._start_page = config.get('settings', 'search_HREF')
@@ -36,81 +107,537 @@ class Scrapper:
             BeautifulSoup(html, features='html.parser')
             self._soup_parser = 'html.parser'
 
-    @retry()
-    def _get_page_soup(self, href):
+    def _make_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=self._search_workers + self._pagination_workers + self._form_workers)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    @staticmethod
+    def _count_request(started, status):
+        metrics.observe('fpds_request_seconds', time.monotonic() - started)
+        metrics.count('fpds_responses', status=status or 'error')
+
+    def _check_response(self, href, status, retry_after):
+        if status == 429 or status >= 500:
+            logger.warning(self.config.get('warning', 'fpds_throttled').format(status, href))
+            raise FpdsResponseError(status, retry_after)
+
+    @property
+    def _retry_budget(self):
+        return getattr(self._thread, 'budget', None) or self._budget
+
+    @retry(exceptions=(FpdsConnectionError, FpdsResponseError), budget='_retry_budget')
+    def _get_page(self, href, binary=False):
+        status, retry_after = None, None
+        started = self._limiter.acquire()
         try:
-            r = requests.get(href)
-        except Exception:
-            logger.error(self.config.get('error', 'fpds_site_not_response'))
-            raise Exception
-        soup = BeautifulSoup(r.text, features=self._soup_parser)
-        return soup
+            try:
+                r = self._session.get(href, timeout=self._timeout)
+            except Exception:
+                logger.error(self.config.get('error', 'fpds_site_not_response'))
+                raise FpdsConnectionError
+            status, retry_after = r.status_code, parse_retry_after(r.headers.get('Retry-After'))
+            metrics.count('fpds_bytes', len(r.content))
+        finally:
+            self._limiter.release(started, status, retry_after)
+            self._count_request(started, status)
+        self._check_response(href, status, retry_after)
+        return r.content if binary else r.text
 
-    def _site_validation(self, href):
-        soup = self._get_page_soup(href)
+    @retry(exceptions=(FpdsConnectionError, FpdsResponseError), budget='_retry_budget')
+    async def _aget_page(self, href, binary=False):
+        status, retry_after = None, None
+        started = await self._limiter.acquire_async()
+        try:
+            try:
+                async with self._session.get(href) as r:
+                    status, retry_after = r.status, parse_retry_after(r.headers.get('Retry-After'))
+                    body = await r.read()
+                    metrics.count('fpds_bytes', len(body))
+                    encoding = r.get_encoding()
+            except Exception:
+                logger.error(self.config.get('error', 'fpds_site_not_response'))
+                raise FpdsConnectionError
+        finally:
+            self._limiter.release(started, status, retry_after)
+            self._count_request(started, status)
+        self._check_response(href, status, retry_after)
+        return body if binary else self._decode(body, encoding)
+
+    @staticmethod
+    def _decode(body, encoding):
+        # As requests' Response.text of the thread engine: a bad byte is replaced, it doesn't fail the page
+        try:
+            return str(body, encoding, errors='replace')
+        except (LookupError, TypeError):
+            return str(body, errors='replace')
+
+    def _get_page_soup(self, href):
+        return BeautifulSoup(self._get_page(href), features=self._soup_parser)
+
+    async def _aget_page_soup(self, href):
+        return BeautifulSoup(await self._aget_page(href), features=self._soup_parser)
+
+    def _check_site(self, soup):
         if soup.find('form', {'name': 'search_awardfull'}):
             return None
         logger.error(self.config.get('error', 'wrong_fpds_href'))
         raise Exception
 
-    def _scrape_forms_hrefs(self, page, not_soup=True):
-        if not_soup:
-            soup = self._get_page_soup(page)
-        else:
-            soup = page
-        hrefs = [self._build_href(self._start_page, href['href'], 'FORM') for href in soup.find_all(title='View')]
-        self._form_hrefs.extend(hrefs)
-        return None
-
-    def _scrape_search_pages(self, search_name):
-        if not search_name.strip():
-            return ''
-        search_href = '{0}?{1}'.format(self._start_page, urlencode({'q': search_name.strip()}))
-        soup = self._get_page_soup(search_href)
+    def _site_validation(self, href):
+        self._check_site(self._get_page_soup(href))
+
+    def _parse_forms_hrefs(self, soup, meta):
+        hrefs = []
+        for link in soup.find_all(title='View'):
+            href = self._build_href(self._start_page, link['href'], 'FORM')
+            if self._store.enabled or self._worker:
+                meta[href] = self._result_meta(link)
+            hrefs.append(href)
+        return hrefs
+
+    @staticmethod
+    def _result_meta(link):
+        # Dates of the award's result row (signed, last modified): the rest of the block depends on the layout
+        # and on the search which found it, an award reached by several searches must get one hash
+        block = link.find_parent('table') or link.parent
+        dates = _DATE.findall(block.get_text(' '))
+        if not dates:
+            return None  # unknown layout: the award is taken like without the incremental mode
+        return hashlib.sha1(' '.join(dates).encode('utf-8')).hexdigest()
+
+    def _parse_search_page(self, search_href, soup, meta):
         try:
             b_items = soup.find('span', {'class': 'results_heading'}).find_all_next('b')
             page_index = int(b_items[1].text)
             last_index = int(b_items[2].text)
-            if last_index == 0:
-                return ''
-            elif last_index > page_index:
-                items_iter = range(0, last_index, page_index)
-                pagination = ['{0}&{1}'.format(search_href, urlencode({'start': i})) for i in items_iter]
-                self._pagination_hrefs.extend(pagination)
-            else:
-                self._scrape_forms_hrefs(soup, False)
-            return search_name
         except Exception:
             logger.error('Unable to found "results_heading". \n HREF: {0}'.format(search_href))
             raise Exception
+        if last_index == 0:
+            return None, [], []
+        elif last_index > page_index:
+            items_iter = range(0, last_index, page_index)
+            return True, ['{0}&{1}'.format(search_href, urlencode({'start': i})) for i in items_iter], []
+        return True, [], self._parse_forms_hrefs(soup, meta)
+
+    def _claim_forms(self, search_name, hrefs):
+        # Returns hrefs no search has reached yet, every search name which reached an award is kept
+        new = []
+        with self._awards_lock:
+            for href in hrefs:
+                names = self._award_names.setdefault(href, [])
+                if not names:
+                    new.append(href)
+                if search_name not in names:
+                    names.append(search_name)
+        return new
+
+    def _found_search_page(self, search_name, found, pagination, forms):
+        if found:
+            self._searched_names.add(search_name)
+        for href in pagination:
+            self._page_names[href] = search_name
+        return self._claim_forms(search_name, forms)
+
+    def _found_search_result(self, search_name, result):
+        self._keep_meta(result)
+        found, pagination, forms = result['found'], result['pagination'], result['forms']
+        self._journal.search(search_name, found, pagination, forms)
+        return self._found_search_page(search_name, found, pagination, forms)
+
+    def _scrape_search_page(self, search_name):
+        result = self._fetch('search', search_name)
+        forms = self._found_search_result(search_name, result)
+        for href in result['pagination']:
+            self._pipeline.put('pagination', href)
+        for href in forms:
+            self._pipeline.put('form', href)
+
+    async def _ascrape_search_page(self, search_name):
+        result = await self._afetch('search', search_name)
+        forms = self._found_search_result(search_name, result)
+        for href in result['pagination']:
+            await self._pipeline.put('pagination', href)
+        for href in forms:
+            await self._pipeline.put('form', href)
+
+    def _found_page_result(self, page, result):
+        self._keep_meta(result)
+        self._journal.page(page, result['forms'])
+        return self._claim_forms(self._page_names.get(page), result['forms'])
+
+    def _scrape_forms_hrefs(self, page):
+        for href in self._found_page_result(page, self._fetch('pagination', page)):
+            self._pipeline.put('form', href)
+
+    async def _ascrape_forms_hrefs(self, page):
+        for href in self._found_page_result(page, await self._afetch('pagination', page)):
+            await self._pipeline.put('form', href)
+
+    def _feed_search_href(self, search_name):
+        return '{0}&{1}'.format(self._feed_href, urlencode({'q': search_name.strip()}))
+
+    def _feed_entries(self, body):
+        # award href (the View href query of the award) -> fields, next feed page
+        entries, next_href = self._feed.parse(body)
+        fields = {self._canonical_href('{0}?{1}'.format(self._start_page, urlencode(identity))): values
+                  for identity, values in entries}
+        return fields, [next_href] if next_href else []
+
+    def _add_feed_forms(self, fields, hrefs):
+        for href in hrefs:
+            self._journal.form(href, fields[href])
+            self._add_form(href, fields[href])
+
+    def _found_feed_page(self, page, fields, pagination):
+        self._journal.page(page, list(fields), pagination)
+        search_name = self._page_names.get(page)
+        for href in pagination:
+            self._page_names[href] = search_name
+        self._add_feed_forms(fields, self._claim_forms(search_name, list(fields)))
+
+    def _found_feed_search(self, search_name, result):
+        found, pagination, fields = result['found'], result['pagination'], result['fields']
+        self._journal.search(search_name, found, pagination, list(fields))
+        self._add_feed_forms(fields, self._found_search_page(search_name, found, pagination, list(fields)))
+
+    def _scrape_feed_search(self, search_name):
+        result = self._fetch('feed_search', search_name)
+        self._found_feed_search(search_name, result)
+        for href in result['pagination']:
+            self._pipeline.put('pagination', href)
+
+    async def _ascrape_feed_search(self, search_name):
+        result = await self._afetch('feed_search', search_name)
+        self._found_feed_search(search_name, result)
+        for href in result['pagination']:
+            await self._pipeline.put('pagination', href)
+
+    # A feed page follows its next links itself: putting them back into its own bounded queue would block
+    # every pagination worker once the queue is full, with nothing left to take them out
+
+    def _scrape_feed_page(self, page):
+        while page and self._pipeline.error is None:
+            result = self._fetch('feed_page', page)
+            self._found_feed_page(page, result['fields'], result['pagination'])
+            page = next(iter(result['pagination']), None)
+
+    async def _ascrape_feed_page(self, page):
+        while page and self._pipeline.error is None:
+            result = await self._afetch('feed_page', page)
+            self._found_feed_page(page, result['fields'], result['pagination'])
+            page = next(iter(result['pagination']), None)
+
+    @staticmethod
+    def _canonical_href(href):
+        # One award is reached from different searches with the same query in any order
+        parts = urlsplit(href)
+        query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+        return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, query, ''))
+
+    @staticmethod
+    def _name_key(search_name):
+        return ' '.join(search_name.split()).lower()
 
     @staticmethod
     def _build_href(base_href, sub, href_type):
         if href_type == 'FORM':
-            return urljoin(base_href, sub.split("'")[1])
+            return Scrapper._canonical_href(urljoin(base_href, sub.split("'")[1]))
         elif href_type == 'PAGN':
             return
         elif href_type == 'SEARCH':
             return '{0}?{1}'.format(base_href, urlencode({'q': sub.strip()}))
 
+    def _add_form(self, href, fields):
+        metrics.count('forms')
+        if self._output is not None:
+            self._output.append([fields.get(self._mapping.get(k, None)) for k in self._mapping.keys()])
+        else:
+            self._forms.add(href, fields)
+
+    def _known_fields(self, href):
+        meta = self._form_meta.get(href)
+        if meta is None:
+            return self._cache.get(href)
+        return self._store.get(href, meta)  # changed awards skip the cache too, it can hold the old fields
+
+    def _save_fields(self, href, fields):
+        self._cache.set(href, fields)
+        self._store.set(href, self._form_meta.get(href), fields)
+
     def _scrape_form(self, href):
-        result = {k: None for k in self._mapping.values()}
-        soup = self._get_page_soup(href)
-        for k, v in self._mapping_form_tags.items():
-            tag = soup.find(id=k)
-            if tag:
-                if v == 'input':
-                    result[k] = tag.attrs.get('value')
-                elif v == 'checkbox':
-                    result[k] = bool(tag.attrs.get('checked'))
-                elif v == 'td' or v == 'text':
-                    result[k] = tag.text
-                elif v == 'select':
-                    option = tag.find_next('option', {'selected': 'true'})
-                    if option:
-                        result[k] = option.text
-        form = [result.get(self._mapping.get(k, None)) for k in self._mapping.keys()]
-        self._forms.append(form)
+        fields = self._known_fields(href)
+        if fields is None:
+            fields = self._fetch('form', href, self._form_meta.get(href))['fields']
+            self._save_fields(href, fields)
+        self._journal.form(href, fields)
+        self._add_form(href, fields)
+
+    async def _ascrape_form(self, href):
+        # SQLite reads and writes of the cache / award store wait for their lock, they run off the event loop
+        loop = asyncio.get_running_loop()
+        fields = await loop.run_in_executor(None, self._known_fields, href)
+        if fields is None:
+            fields = (await self._afetch('form', href, self._form_meta.get(href)))['fields']
+            await loop.run_in_executor(None, self._save_fields, href, fields)
+        self._journal.form(href, fields)
+        self._add_form(href, fields)
+
+    # Fetch and parse of one item, for the pipeline stages and for worker.py. Results are plain data: they are
+    # shared through the single flight LRU by all jobs of the process and sent back through the work queue
+
+    def _flight_key(self, kind, item, meta):
+        if kind == 'search':
+            return kind, self._build_href(self._start_page, item, 'SEARCH')
+        elif kind == 'feed_search':
+            return kind, self._feed_search_href(item)
+        elif kind == 'form':
+            return kind, item, meta  # a changed award is not taken from the LRU
+        return kind, item
+
+    def _fetch(self, kind, item, meta=None):
+        handlers = {'search': self._work_search, 'pagination': self._work_page, 'form': self._work_form,
+                    'feed_search': self._work_feed_search, 'feed_page': self._work_feed_page}
+        return self._flights.do(self._flight_key(kind, item, meta), partial(handlers[kind], item),
+                                cached=not self._cache.bypass)
+
+    async def _afetch(self, kind, item, meta=None):
+        handlers = {'search': self._awork_search, 'pagination': self._awork_page, 'form': self._awork_form,
+                    'feed_search': self._awork_feed_search, 'feed_page': self._awork_feed_page}
+        return await self._flights.do_async(self._flight_key(kind, item, meta), partial(handlers[kind], item),
+                                            cached=not self._cache.bypass)
+
+    def _keep_meta(self, result):
+        if self._store.enabled:
+            self._form_meta.update(result['meta'])
+
+    def _search_result(self, search_href, soup):
+        meta = {}
+        found, pagination, forms = self._parse_search_page(search_href, soup, meta)
+        return {'found': found, 'pagination': pagination, 'forms': forms, 'meta': meta}
+
+    def _page_result(self, soup):
+        meta = {}
+        forms = self._parse_forms_hrefs(soup, meta)
+        return {'forms': forms, 'meta': meta}
+
+    def _work_search(self, search_name):
+        search_href = self._build_href(self._start_page, search_name, 'SEARCH')
+        return self._search_result(search_href, self._get_page_soup(search_href))
+
+    async def _awork_search(self, search_name):
+        search_href = self._build_href(self._start_page, search_name, 'SEARCH')
+        return self._search_result(search_href, await self._aget_page_soup(search_href))
+
+    def _work_page(self, page):
+        return self._page_result(self._get_page_soup(page))
+
+    async def _awork_page(self, page):
+        return self._page_result(await self._aget_page_soup(page))
+
+    def _work_feed_search(self, search_name):
+        fields, pagination = self._feed_entries(self._get_page(self._feed_search_href(search_name), binary=True))
+        return {'found': True if fields else None, 'pagination': pagination, 'fields': fields}
+
+    async def _awork_feed_search(self, search_name):
+        fields, pagination = self._feed_entries(await self._aget_page(self._feed_search_href(search_name),
+                                                                      binary=True))
+        return {'found': True if fields else None, 'pagination': pagination, 'fields': fields}
+
+    def _work_feed_page(self, page):
+        fields, pagination = self._feed_entries(self._get_page(page, binary=True))
+        return {'pagination': pagination, 'fields': fields}
+
+    async def _awork_feed_page(self, page):
+        fields, pagination = self._feed_entries(await self._aget_page(page, binary=True))
+        return {'pagination': pagination, 'fields': fields}
+
+    def _work_form(self, href):
+        return {'fields': self._parsers.extract(self._get_page(href))}
+
+    async def _awork_form(self, href):
+        return {'fields': await self._parsers.extract_async(await self._aget_page(href))}
+
+    # worker.py: items of the work queue are fetched for their coordinators
+
+    def open_worker(self):
+        self._worker = True
+        self._set_soup_parser()
+        self._mapping_form_tags = {value[0]: value[1] for value in self._mapping.values() if value[0]}
+        self._parsers = ParserPool(self.config, self._mapping_form_tags).open()
+        if self._backend == 'atom' and etree is not None:
+            self._feed = FeedParser(get_output_map(self.config, logger, path_key='atom_mapping'))
+        self._session = self._make_session()
+        if self._backend == 'html':
+            self._site_validation(self._start_page)
+        return self
+
+    def _run_budget(self, run):
+        # Retry budget and circuit of one run, a worker serves many: the failures of one coordinator's run don't
+        # open the circuit for the others. Budgets of runs without items for stall_timeout seconds are dropped
+        now = time.monotonic()
+        with self._run_budgets_lock:
+            budget = self._run_budgets.pop(run, (None, None))[0] or RetryBudget(self.config)
+            self._run_budgets[run] = (budget, now)
+            while self._stall_timeout and now - next(iter(self._run_budgets.values()))[1] > self._stall_timeout:
+                self._run_budgets.popitem(last=False)
+        return budget
+
+    def work(self, kind, item, run=None):
+        meta = None
+        if kind == 'form':  # [href, hash of its search result row] of the coordinator
+            item, meta = json.loads(item)
+        self._thread.budget = self._run_budget(run)
+        try:
+            return self._fetch(kind, item, meta)
+        finally:
+            self._thread.budget = None
+
+    def idle(self):
+        # The queue is drained: runs start again with full budgets
+        with self._run_budgets_lock:
+            self._run_budgets.clear()
+
+    def close_worker(self):
+        self._parsers.close()
+        self._session.close()
+
+    # Coordinator side: items are published to the queue, results are recorded as the pipeline stages do
+
+    def _publish(self, kind, items):
+        items = list(items)
+        if items:
+            self._queue.publish(self._run_id, kind, items)
+            self._published[kind] = self._published.get(kind, 0) + len(items)
+
+    def _publish_forms(self, hrefs):
+        # Awards of the cache / award store are not sent to the workers
+        pending = []
+        for href in hrefs:
+            fields = self._known_fields(href)
+            if fields is None:
+                pending.append(href)
+            else:
+                self._journal.form(href, fields)
+                self._add_form(href, fields)
+        self._publish('form', [json.dumps([href, self._form_meta.get(href)]) for href in pending])
+
+    def _collected_search(self, search_name, result):
+        forms = self._found_search_result(search_name, result)
+        self._publish('pagination', result['pagination'])
+        self._publish_forms(forms)
+
+    def _collected_page(self, page, result):
+        self._publish_forms(self._found_page_result(page, result))
+
+    def _collected_feed_search(self, search_name, result):
+        self._found_feed_search(search_name, result)
+        self._publish('feed_page', result['pagination'])
+
+    def _collected_feed_page(self, page, result):
+        self._found_feed_page(page, result['fields'], result['pagination'])
+        self._publish('feed_page', result['pagination'])
+
+    def _collected_form(self, item, result):
+        href = json.loads(item)[0]
+        self._save_fields(href, result['fields'])
+        self._journal.form(href, result['fields'])
+        self._add_form(href, result['fields'])
+
+    def _run_queue(self):
+        self._run_id = self._queue.new_run()
+        logger.info(self.config.get('info', 'work_queue_run').format(self._run_id, self._queue))
+        logger.info(self.config.get('info', 'parse_search_names').format(len(self._search_names)))
+        if self._feed is None:
+            search_kind, page_kind = 'search', 'pagination'
+            handlers = {'search': self._collected_search, 'pagination': self._collected_page}
+        else:
+            search_kind, page_kind = 'feed_search', 'feed_page'
+            handlers = {'feed_search': self._collected_feed_search, 'feed_page': self._collected_feed_page}
+        handlers['form'] = self._collected_form
+        try:
+            self._publish(search_kind, self._search_items())
+            seeds = self._resume_items()
+            self._publish(page_kind, seeds['pagination'])
+            self._publish_forms(seeds['form'])
+            collected = time.monotonic()
+            while sum(self._published.values()) > sum(self._collected.values()):
+                items = self._queue.collect(self._run_id)
+                if not items:
+                    if self._stall_timeout and time.monotonic() - collected > self._stall_timeout:
+                        logger.error(self.config.get('error', 'work_queue_stalled').format(self._stall_timeout))
+                        raise Exception
+                    time.sleep(self._poll_interval)
+                    continue
+                collected = time.monotonic()
+                for kind, item, result, error in items:
+                    self._collected[kind] = self._collected.get(kind, 0) + 1
+                    if error is not None:
+                        logger.error(self.config.get('error', 'work_item_failed').format(kind, item, error))
+                        raise Exception
+                    handlers[kind](item, result)
+                    metrics.progress(kind, self._collected[kind], self._published[kind])
+        finally:
+            self._queue.drop(self._run_id)
+            for kind, total in self._published.items():
+                metrics.progress(kind, self._collected.get(kind, 0), total, final=True)
+
+    def _make_stages(self, search_handler, pagination_handler, form_handler):
+        return [Stage('search', search_handler, self._search_workers, self._queue_size),
+                Stage('pagination', pagination_handler, self._pagination_workers, self._queue_size),
+                Stage('form', form_handler, self._form_workers, self._queue_size)]
+
+    def _search_items(self):
+        names = {}
+        for name in self._search_names:
+            if name.strip():
+                names.setdefault(self._name_key(name), name)
+        return [name for name in names.values() if name not in self._journal.searches]
+
+    def _resume_items(self):
+        for name, (found, pagination, forms) in self._journal.searches.items():
+            self._found_search_page(name, found, pagination, forms)
+        for page, forms in self._journal.pages.items():
+            for href in self._journal.page_links.get(page, []):
+                self._page_names[href] = self._page_names.get(page)
+            self._claim_forms(self._page_names.get(page), forms)
+        for href, fields in self._journal.forms.items():
+            self._add_form(href, fields)
+        return {'pagination': self._journal.pending_pages(), 'form': list(dict.fromkeys(self._journal.pending_forms()))}
+
+    def _run_threads(self):
+        self._session = self._make_session()
+        try:
+            if self._feed is None:
+                self._site_validation(self._start_page)
+            logger.info(self.config.get('info', 'parse_search_names').format(len(self._search_names)))
+            if self._feed is None:
+                stages = self._make_stages(self._scrape_search_page, self._scrape_forms_hrefs, self._scrape_form)
+            else:
+                stages = self._make_stages(self._scrape_feed_search, self._scrape_feed_page, self._scrape_form)
+            self._pipeline = ThreadPipeline(stages)
+            self._pipeline.run(self._search_items(), self._resume_items())
+        finally:
+            self._session.close()
+
+    async def _run_async(self):
+        connector = aiohttp.TCPConnector(limit=self._concurrency, limit_per_host=self._connections_per_host)
+        timeout = aiohttp.ClientTimeout(total=self._timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            self._session = session
+            if self._feed is None:
+                self._check_site(await self._aget_page_soup(self._start_page))
+            logger.info(self.config.get('info', 'parse_search_names').format(len(self._search_names)))
+            if self._feed is None:
+                stages = self._make_stages(self._ascrape_search_page, self._ascrape_forms_hrefs, self._ascrape_form)
+            else:
+                stages = self._make_stages(self._ascrape_feed_search, self._ascrape_feed_page, self._ascrape_form)
+            self._pipeline = AsyncPipeline(stages)
+            await self._pipeline.run(self._search_items(), self._resume_items())
 
     def run(self, search_names, message):
 
@@ -118,24 +645,65 @@ class Scrapper:
             logger.info(self.config.get('info', 'scrapping'))
             self._set_soup_parser()
             self._mapping_form_tags = {value[0]: value[1] for value in self._mapping.values() if value[0]}
+            self._parsers = ParserPool(self.config, self._mapping_form_tags)
+            if self._backend == 'atom' and etree is None:
+                logger.warning(self.config.get('warning', 'no_lxml_feed'))
+                self._backend = 'html'
+            if self._backend == 'atom':
+                self._feed = FeedParser(get_output_map(self.config, logger, path_key='atom_mapping'))
             self._mapping = {key: value[0] for key, value in self._mapping.items()}
             self._search_names = search_names
-            self._site_validation(self.config.get('settings', 'search_HREF'))
-            logger.info(self.config.get('info', 'parse_search_names').format(len(search_names)))
-            with ThreadPool(self._pool) as p:
-                searched_names = list(tqdm.tqdm(p.imap(self._scrape_search_pages, list(set(self._search_names))),
-                                                total=len(set(self._search_names))))
-            self.success_names = [(True if (name in searched_names and name.strip() != '') else False)
-                                  for name in self._search_names]
-            with ThreadPool(self._pool) as p:
-                list(tqdm.tqdm(p.imap(self._scrape_forms_hrefs, self._pagination_hrefs),
-                               total=len(self._pagination_hrefs)))
-            logger.info(self.config.get('info', 'parse_forms').format(len(self._form_hrefs)))
-            with ThreadPool(self._pool) as p:
-                list(tqdm.tqdm(p.imap(self._scrape_form, self._form_hrefs), total=len(self._form_hrefs)))
-            if self._forms:
-                self.forms_df = pd.DataFrame.from_records(self._forms)
-                self.forms_df.columns = self._mapping.keys()
+            checkbox_columns = [key for key, tag_id in self._mapping.items()
+                                if self._mapping_form_tags.get(tag_id) == 'checkbox']
+            self._forms = ResultCollector(self._mapping, checkbox_columns,
+                                          self.config.getfloat('settings', 'category_share', fallback=0.5))
+            if self._engine == 'asyncio' and aiohttp is None:
+                logger.warning(self.config.get('warning', 'no_aiohttp'))
+                self._engine = 'thread'
+            self._cache.open()
+            self._store.open()
+            if self._queue is not None:
+                self._queue.open()
+            else:
+                self._parsers.open()
+            # a letter's run is resumed by the same letter only, whatever temp folder the job got
+            self._journal = Journal(self.config, self._search_names,
+                                    job=getattr(message, 'letter_id', '') or message.temp_dir).open()
+            if self._output is not None:
+                if self._link_column:
+                    logger.warning(self.config.get('warning', 'link_column_stream').format(self._output.format))
+                self._output.open(list(self._mapping.keys()), checkbox_columns)
+            completed = False
+            try:
+                with metrics.phase('scrape'):
+                    if self._queue is not None:
+                        self._run_queue()
+                    elif self._engine == 'asyncio':
+                        asyncio.run(self._run_async())
+                    else:
+                        self._run_threads()
+                completed = True
+            finally:
+                if self._output is not None:
+                    self._output.close()
+                self._journal.close(completed)
+                self._parsers.close()
+                self._cache.close()
+                self._store.close()
+                if self._queue is not None:
+                    self._queue.close()
+                logger.info(self.config.get('info', 'retry_stats').format(
+                    {k: dict(v) for k, v in self._retry_budget.stats.items()}))
+            logger.info(self.config.get('info', 'parse_forms').format(
+                self._output.rows if self._output is not None else len(self._forms)))
+            searched = {self._name_key(name) for name in self._searched_names}
+            self.success_names = [self._name_key(name) in searched for name in self._search_names]
+            if len(self._forms):
+                self.forms_df = self._forms.frame()
+                if self._link_column:
+                    self.forms_df[self._link_column] = ['; '.join(self._award_names.get(href, []))
+                                                        for href in self._forms.hrefs]
+                self._forms.clear()
         except Exception:
             logger.error(self.config.get('error', 'fpds_site'), exc_info=True)
             message.send_fail_to_admin(letter=3)
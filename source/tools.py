@@ -1,7 +1,10 @@
+import asyncio
+import random
+import threading
 import time
 import os
 import json
-from collections import OrderedDict
+from collections import Counter, OrderedDict, defaultdict
 from shutil import rmtree
 from configparser import ConfigParser, ExtendedInterpolation
 import logging.config
@@ -18,30 +21,154 @@ def read_config(logger):
         raise Exception
 
 
-def get_output_map(config, logger):
-    if not os.path.exists(config.get('path', 'mapping')):
-        logger.error(config.get('error', 'output_columns_path').format(config.get('path', 'mapping')))
+_maps = {}  # mapping path -> (mtime, size, parsed json); the daemon and every job read them again
+_maps_lock = threading.Lock()
+
+
+def get_output_map(config, logger, path_key='mapping'):
+    if not os.path.exists(config.get('path', path_key)):
+        logger.error(config.get('error', 'output_columns_path').format(config.get('path', path_key)))
         raise Exception
     try:
-        with open(config.get('path', 'mapping'), 'r') as reader:
-            input_json = reader.read()
-        json_map = json.loads(input_json)
-        return OrderedDict(json_map)
+        map_path = config.get('path', path_key)
+        stat = os.stat(map_path)
+        with _maps_lock:
+            cached = _maps.get(map_path)
+        if cached is None or cached[:2] != (stat.st_mtime_ns, stat.st_size):
+            with open(map_path, 'r') as reader:
+                input_json = reader.read()
+            cached = (stat.st_mtime_ns, stat.st_size, json.loads(input_json))
+            with _maps_lock:
+                _maps[map_path] = cached
+        return OrderedDict(cached[2])
     except Exception:
-        logger.error(config.get('error', 'output_columns').format(config.get('path', 'mapping')))
+        logger.error(config.get('error', 'output_columns').format(config.get('path', path_key)))
         raise Exception
 
 
-def retry(attempts=3, sleep_time=5):
+class CircuitOpenError(Exception):
+    pass
+
+
+class RetryBudget:
+
+    def __init__(self, config, section='retry'):
+        self.retries_left = config.getint(section, 'budget', fallback=1000)
+        self.failure_threshold = config.getint(section, 'failure_threshold', fallback=20)
+        self.reset_seconds = config.getfloat(section, 'reset_seconds', fallback=60)
+        self._failures = 0
+        self._opened = None
+        self._lock = threading.Lock()
+        self.stats = defaultdict(Counter)  # retry_stats of this budget's run only
+
+    def count(self, name, event):
+        with self._lock:
+            self.stats[name][event] += 1
+
+    def check(self):
+        with self._lock:
+            if self._opened is None:
+                return
+            if time.monotonic() - self._opened < self.reset_seconds:
+                raise CircuitOpenError('Too many consecutive failures, circuit is open')
+            self._opened = None  # half-open: let the next call try again
+            self._failures = self.failure_threshold - 1
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.failure_threshold and self._opened is None:
+                self._opened = time.monotonic()
+
+    def take_retry(self):
+        with self._lock:
+            if self._opened is not None or self.retries_left <= 0:
+                return False
+            self.retries_left -= 1
+            return True
+
+
+retry_stats = defaultdict(Counter)
+_retry_stats_lock = threading.Lock()
+
+
+def _count_retry(name, event, run_budget=None):
+    # retry_stats are process wide (metrics report), the run's budget keeps the counters of its run
+    with _retry_stats_lock:
+        retry_stats[name][event] += 1
+    if run_budget is not None:
+        run_budget.count(name, event)
+
+
+def _backoff(i, sleep_time, max_sleep, exception):
+    delay = random.uniform(0, min(max_sleep, sleep_time * 2 ** i))  # full jitter
+    return max(delay, min(getattr(exception, 'retry_after', None) or 0, max_sleep))
+
+
+def retry(attempts=3, sleep_time=5, max_sleep=60, exceptions=(Exception,), budget=None):
+    # budget - RetryBudget or name of the RetryBudget attribute of the decorated method's instance
     def inner_function(function):
+        name = function.__qualname__
+
+        def get_budget(args):
+            if isinstance(budget, str):
+                return getattr(args[0], budget, None)
+            return budget
+
+        def before_attempt(run_budget):
+            _count_retry(name, 'calls', run_budget)
+            if run_budget is not None:
+                try:
+                    run_budget.check()
+                except CircuitOpenError:
+                    _count_retry(name, 'short_circuited', run_budget)
+                    raise
+
+        def after_failure(i, run_budget, exception):
+            if run_budget is not None:
+                run_budget.failure()
+            if not isinstance(exception, exceptions) or i + 1 == attempts or \
+                    (run_budget is not None and not run_budget.take_retry()):
+                _count_retry(name, 'failures', run_budget)
+                return False
+            _count_retry(name, 'retries', run_budget)
+            return True
+
+        if asyncio.iscoroutinefunction(function):
+            async def async_wrapper(*args, **kwargs):
+                run_budget = get_budget(args)
+                for i in range(attempts):
+                    before_attempt(run_budget)
+                    try:
+                        result = await function(*args, **kwargs)
+                    except Exception as e:
+                        if not after_failure(i, run_budget, e):
+                            raise e
+                        await asyncio.sleep(_backoff(i, sleep_time, max_sleep, e))
+                    else:
+                        if run_budget is not None:
+                            run_budget.success()
+                        return result
+            return async_wrapper
+
         def wrapper(*args, **kwargs):
+            run_budget = get_budget(args)
             for i in range(attempts):
+                before_attempt(run_budget)
                 try:
-                    return function(*args, **kwargs)
+                    result = function(*args, **kwargs)
                 except Exception as e:
-                    if i + 1 == attempts:
+                    if not after_failure(i, run_budget, e):
                         raise e
-                    time.sleep(sleep_time)
+                    time.sleep(_backoff(i, sleep_time, max_sleep, e))
+                else:
+                    if run_budget is not None:
+                        run_budget.success()
+                    return result
         return wrapper
     return inner_function
 
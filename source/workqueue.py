@@ -0,0 +1,163 @@
+import importlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class WorkQueue:
+    # Work items of scrapping runs shared by the coordinator (Scrapper.run) and worker.py processes on any node.
+    # A leased item which is not completed in lease_seconds (the worker died) is given to another worker, an item
+    # which failed max_attempts times is returned to the coordinator with its error. Results are collected, and
+    # removed from the queue, by the coordinator of the run. Other backends implement the same methods and are
+    # named in [queue] backend as package.module.Class
+
+    def __init__(self, config):
+        self.config = config
+        self.lease_seconds = config.getfloat('queue', 'lease_seconds', fallback=300)
+        self.max_attempts = config.getint('queue', 'max_attempts', fallback=3)
+
+    def open(self):
+        return self
+
+    @staticmethod
+    def new_run():
+        return uuid.uuid4().hex
+
+    def publish(self, run, kind, items):
+        raise NotImplementedError
+
+    def lease(self, worker, limit=1):
+        # [(item id, run, kind, item)]
+        raise NotImplementedError
+
+    def complete(self, item_id, worker, result):
+        # Ignored when the lease of the worker expired, the item is another worker's now
+        raise NotImplementedError
+
+    def fail(self, item_id, worker, error):
+        raise NotImplementedError
+
+    def collect(self, run, limit=500):
+        # [(kind, item, result, error)] of finished items of the run, they are removed from the queue
+        raise NotImplementedError
+
+    def drop(self, run):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SqliteWorkQueue(WorkQueue):
+    # Queue in one SQLite file: processes of one host, or of several nodes which share the file
+    # (journal_mode DELETE there, WAL needs shared memory of one host)
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.path = config.get('path', 'work_queue')
+        self.journal_mode = config.get('queue', 'journal_mode', fallback='WAL')
+        self.retention = config.getfloat('queue', 'retention_hours', fallback=24) * 3600
+        self._connect = None
+        self._lock = threading.Lock()
+
+    def __str__(self):
+        return self.path
+
+    def open(self):
+        if self._connect is not None:
+            return self
+        if not os.path.exists(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._connect = sqlite3.connect(self.path, check_same_thread=False, timeout=60, isolation_level=None)
+        self._connect.execute('PRAGMA journal_mode={0}'.format(self.journal_mode))
+        self._connect.execute('PRAGMA synchronous=NORMAL')
+        self._connect.execute('CREATE TABLE IF NOT EXISTS items (id INTEGER PRIMARY KEY AUTOINCREMENT, run TEXT, '
+                              'kind TEXT, item TEXT, state TEXT, worker TEXT, lease_until REAL, attempts INTEGER, '
+                              'result TEXT, error TEXT, created REAL)')
+        self._connect.execute('CREATE INDEX IF NOT EXISTS items_state ON items (state, id)')
+        self._connect.execute('CREATE INDEX IF NOT EXISTS items_run ON items (run, state)')
+        # items of coordinators which crashed
+        self._connect.execute('DELETE FROM items WHERE created < ?', (time.time() - self.retention,))
+        return self
+
+    def _transaction(self, function, *args):
+        # BEGIN IMMEDIATE takes the write lock at once, two workers never lease the same item
+        with self._lock:
+            self._connect.execute('BEGIN IMMEDIATE')
+            try:
+                result = function(*args)
+            except Exception:
+                self._connect.execute('ROLLBACK')
+                raise
+            self._connect.execute('COMMIT')
+            return result
+
+    def publish(self, run, kind, items):
+        now = time.time()
+        with self._lock:
+            self._connect.executemany("INSERT INTO items (run, kind, item, state, attempts, created) "
+                                      "VALUES (?, ?, ?, 'ready', 0, ?)", [(run, kind, item, now) for item in items])
+
+    def _lease(self, worker, limit):
+        now = time.time()
+        self._connect.execute("UPDATE items SET state = 'failed', error = 'lease expired' "
+                              "WHERE state = 'leased' AND lease_until < ? AND attempts >= ?", (now, self.max_attempts))
+        rows = self._connect.execute("SELECT id, run, kind, item FROM items WHERE state = 'ready' "
+                                     "OR (state = 'leased' AND lease_until < ?) ORDER BY id LIMIT ?",
+                                     (now, limit)).fetchall()
+        self._connect.executemany("UPDATE items SET state = 'leased', worker = ?, lease_until = ?, "
+                                  "attempts = attempts + 1 WHERE id = ?",
+                                  [(worker, now + self.lease_seconds, row[0]) for row in rows])
+        return rows
+
+    def lease(self, worker, limit=1):
+        return self._transaction(self._lease, worker, limit)
+
+    def complete(self, item_id, worker, result):
+        with self._lock:
+            self._connect.execute("UPDATE items SET state = 'done', result = ? "
+                                  "WHERE id = ? AND state = 'leased' AND worker = ?",
+                                  (json.dumps(result), item_id, worker))
+
+    def fail(self, item_id, worker, error):
+        # Leased again until max_attempts, the error may be of this node only
+        with self._lock:
+            self._connect.execute("UPDATE items SET state = CASE WHEN attempts < ? THEN 'ready' ELSE 'failed' END, "
+                                  "error = ? WHERE id = ? AND state = 'leased' AND worker = ?",
+                                  (self.max_attempts, error, item_id, worker))
+
+    def _collect(self, run, limit):
+        rows = self._connect.execute("SELECT id, kind, item, state, result, error FROM items "
+                                     "WHERE run = ? AND state IN ('done', 'failed') ORDER BY id LIMIT ?",
+                                     (run, limit)).fetchall()
+        self._connect.executemany('DELETE FROM items WHERE id = ?', [(row[0],) for row in rows])
+        return [(kind, item, json.loads(result) if state == 'done' else None, error if state == 'failed' else None)
+                for item_id, kind, item, state, result, error in rows]
+
+    def collect(self, run, limit=500):
+        return self._transaction(self._collect, run, limit)
+
+    def drop(self, run):
+        with self._lock:
+            self._connect.execute('DELETE FROM items WHERE run = ?', (run,))
+
+    def close(self):
+        if self._connect is None:
+            return
+        with self._lock:
+            self._connect.close()
+            self._connect = None
+
+
+def make_work_queue(config):
+    backend = config.get('queue', 'backend', fallback='sqlite')
+    if backend == 'sqlite':
+        return SqliteWorkQueue(config)
+    module, name = backend.rsplit('.', 1)
+    return getattr(importlib.import_module(module), name)(config)
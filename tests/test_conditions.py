@@ -0,0 +1,97 @@
+import os
+import sys
+import unittest
+from configparser import ConfigParser, ExtendedInterpolation
+from math import nan
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pandas as pd
+from source.conditions import ConditionSet
+
+COLUMNS = {'account': 0, 'gsa_num': 1, 'contract_num': 2, 'task_num': 3, 'amount': 4}
+
+RULES = [
+    ("r_c[col['account']] == 'commerce' and not r_c[col['task_num']].startswith('doc')",
+     "f\"DOC{r[col['task_num']]}\""),
+    ("r_c[col['account']] == 'irs' or r_c[col['gsa_num']] == 'nan'",
+     "f\"{r[col['contract_num']]} {r[col['gsa_num']]}\""),
+    ("r_c[col['amount']] in ['5', '1.5', '10'] and r_c[col['gsa_num']] != 'n/a'",
+     "f\"{r[col['contract_num']]}-{r[col['amount']]}\""),
+    ("r_c[col['amount']] == 5 or not (r_c[col['amount']] <= '6' or r_c[col['account']] in ['none'])",
+     "f\"N{r[col['amount']]}\""),
+    ("len(r_c[col['task_num']]) > 6", "f\"{r[col['task_num']]} long\""),  # not vectorizable: row by row
+]
+
+ROWS = [
+    ['Commerce', 'N/A', 'GS-35F', 'DOC 12', 5],
+    ['Commerce', 'GS-35F', 'GS-35F', 'T 2', 1.5],
+    ['IRS', nan, 'TIRNO', 'T 1', None],
+    ['Army', None, 'W91', nan, 10],
+    ['USFEDHHSCDC', 'gs 1', 'HHSD 2', 'hhsd-9', 'x'],
+    [nan, nan, nan, nan, nan],
+    ['Other', 'a', 'b', 'long task', 3],
+    ['Other', 'N/A', 'c', '', 5],
+    [None, 'n/a', 'd', 'e', 2],
+]
+
+
+def make_config(rules):
+    config = ConfigParser(interpolation=ExtendedInterpolation(), delimiters=(':',))
+    config.read_dict({'parse_conditions': dict(rules)})
+    return config
+
+
+def convert(rows):  # as Input._split_rows
+    return rows.astype(str).apply(lambda c: c.str.lower().str.replace('\\s', '', regex=True))
+
+
+def legacy_search_names(config, rows, rows_conv, columns_dict):  # previous Input.parse_input loop
+    names = {}
+    for idx in rows.index:
+        row, row_conv = list(rows.loc[idx]), list(rows_conv.loc[idx])
+        for condition in config.options('parse_conditions'):
+            if eval(condition, {'r_c': row_conv, 'col': columns_dict}):
+                names[idx] = eval(config.get('parse_conditions', condition), {'r': row, 'col': columns_dict})
+                break
+    return names
+
+
+class ConditionSetTest(unittest.TestCase):
+
+    def test_same_names_as_row_by_row(self):
+        config = make_config(RULES)
+        rows = pd.DataFrame(ROWS, dtype=object, index=range(10, 10 + len(ROWS)))
+        rows_conv = convert(rows)
+        conditions = ConditionSet(config)
+        names = conditions.search_names(rows, rows_conv, COLUMNS)
+        expected = legacy_search_names(config, rows, rows_conv, COLUMNS)
+        self.assertEqual(names.dropna().to_dict(), expected)
+        self.assertEqual(expected, {11: 'DOCT 2', 12: 'TIRNO nan', 13: 'W91-10', 14: 'Nx', 15: 'nan nan',
+                                    16: 'long task long'})
+        self.assertEqual([rule.vector_condition is not None for rule in conditions.rules],
+                         [True, True, True, True, False])
+
+    def test_settings_conditions(self):
+        config = ConfigParser(interpolation=ExtendedInterpolation(), delimiters=(':',))
+        config.read(os.path.join(ROOT, 'settings', 'config.cfg'))
+        columns_dict = {key: idx for idx, key in enumerate(config['input_cols'].keys())}
+        cells = [{'account': 'Commerce', 'vehicle_type': 'Other', 'gsa_num': 'N/A', 'task_num': 'T 1'},
+                 {'account': 'IRS', 'vehicle_type': 'BPA', 'gsa_num': 'N/A', 'task_num': ''},
+                 {'account': 'Army', 'vehicle_type': 'Standalone', 'gsa_num': 'GS 1', 'task_num': 'T 2'},
+                 {'account': 'Army', 'vehicle_type': 'Other', 'gsa_num': 'GS 1', 'task_num': nan}]
+        rows = pd.DataFrame([[dict(row, contract_num='C{0}'.format(idx)).get(key, '') for key in columns_dict]
+                             for idx, row in enumerate(cells)], dtype=object)
+        rows_conv = convert(rows)
+        names = ConditionSet(config).search_names(rows, rows_conv, columns_dict)
+        self.assertEqual(names.dropna().to_dict(), legacy_search_names(config, rows, rows_conv, columns_dict))
+        self.assertEqual(names.dropna().to_dict(), {0: 'DOCC0', 1: 'C1 IDV', 2: 'C2 T 2'})
+
+    def test_condition_which_fails_to_parse(self):
+        config = make_config(RULES[:1] + [("r_c[col['account']] ==", "'name'")])
+        self.assertRaises(SyntaxError, ConditionSet, config)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import logging
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from urllib.request import urlopen
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from fakes import FIXTURES, FakeFpds
+from source.emails import Mail
+from source.extractor import FormExtractor
+from source.feed import FeedParser, etree
+from source.tools import get_output_map, read_config
+
+logger = logging.getLogger(__name__)
+
+
+def read_settings():
+    cwd = os.getcwd()
+    os.chdir(ROOT)  # settings/ paths are relative
+    try:
+        config = read_config(logger)
+    finally:
+        os.chdir(cwd)
+    for path_key in ('mapping', 'atom_mapping'):
+        config.set('path', path_key, os.path.join(ROOT, config.get('path', path_key)))
+    return config
+
+FEED = ('<feed xmlns="http://www.w3.org/2005/Atom"><entry><content><award xmlns="https://www.fpds.gov/FPDS">'
+        '<awardID><awardContractID><PIID>{0}</PIID></awardContractID></awardID>'
+        '<dollarValues><obligatedAmount>{1}</obligatedAmount></dollarValues></award></content></entry></feed>')
+
+
+@unittest.skipIf(etree is None, 'lxml is not installed')
+class FeedParserTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        config = read_settings()
+        cls.mapping = get_output_map(config, logger)
+        cls.form_tags = {value[0]: value[1] for value in cls.mapping.values() if value[0]}
+        cls.atom_map = get_output_map(config, logger, path_key='atom_mapping')
+
+    def test_feed_fields_match_form_fields(self):
+        with open(os.path.join(FIXTURES, 'fpds_atom_feed.xml'), 'rb') as reader:
+            entries, next_href = FeedParser(self.atom_map).parse(reader.read())
+        with open(os.path.join(FIXTURES, 'fpds_award_form.html'), encoding='utf-8') as reader:
+            form = FormExtractor(self.form_tags).extract(reader.read())
+        self.assertEqual(len(entries), 1)
+        self.assertIsNone(next_href)
+        fields = entries[0][1]
+        self.assertEqual({tag_id: fields[tag_id] for tag_id in self.atom_map},
+                         {tag_id: form[tag_id] for tag_id in self.atom_map})
+
+    def test_next_links_page_through_results(self):
+        fpds = FakeFpds(results=25, feed_page=10).start()
+        try:
+            parser = FeedParser(self.atom_map)
+            href = '{0}&q=Vendor'.format(fpds.feed_href)
+            pages = []
+            while href:
+                with urlopen(href) as response:
+                    entries, href = parser.parse(response.read())
+                pages.append(entries)
+        finally:
+            fpds.stop()
+        self.assertEqual([len(entries) for entries in pages], [10, 10, 5])
+        self.assertEqual([dict(identity)['modNumber'] for entries in pages for identity, fields in entries],
+                         [str(idx) for idx in range(25)])
+
+    def test_malformed_amount_is_empty(self):
+        parser = FeedParser({'PIID': ['awardID/awardContractID/PIID', 'text'],
+                             'obligatedAmount': ['dollarValues/obligatedAmount', 'money']})
+        for amount in ('', '1,234.00', 'n/a', 'NaN'):
+            entries, next_href = parser.parse(FEED.format('A1', amount).encode('utf-8'))
+            self.assertEqual(entries[0][1], {'PIID': 'A1', 'obligatedAmount': ''})
+        entries, next_href = parser.parse(FEED.format('A1', '-1234567.5').encode('utf-8'))
+        self.assertEqual(entries[0][1]['obligatedAmount'], '-$1,234,567.50')
+
+    def test_feed_pages_of_a_small_queue(self):
+        # Next pages of every search fill the pagination queue of queue_size items
+        from source.scrapping import Scrapper
+        fpds = FakeFpds(results=35, feed_page=10).start()
+        try:
+            for engine in ('thread', 'asyncio'):
+                with self.subTest(engine=engine), tempfile.TemporaryDirectory() as work_dir:
+                    config = read_settings()
+                    config.set('path', 'home_dir', work_dir)
+                    config.set('settings', 'search_HREF', fpds.href)
+                    config.set('settings', 'feed_HREF', fpds.feed_href)
+                    config.set('settings', 'backend', 'atom')
+                    config.set('settings', 'engine', engine)
+                    config.set('settings', 'queue_size', '2')
+                    config.set('settings', 'pagination_workers', '2')
+                    for section in ('cache', 'flights', 'journal', 'metrics'):
+                        config.set(section, 'enabled', 'no')
+                    scrapper = Scrapper(config, self.mapping)
+                    thread = threading.Thread(target=scrapper.run, daemon=True,
+                                              args=(['Vendor {0}'.format(idx) for idx in range(20)],
+                                                    Mail(config, temp_dir=os.path.join(work_dir, 'job'))))
+                    thread.start()
+                    thread.join(60)
+                    self.assertFalse(thread.is_alive(), 'the run hangs')
+                    self.assertEqual(len(scrapper.forms_df), 700)
+        finally:
+            fpds.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
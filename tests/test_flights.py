@@ -0,0 +1,111 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import unittest
+from configparser import ConfigParser
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from source.flights import SingleFlight
+
+
+class RecordingFlight(SingleFlight):
+
+    def __init__(self):
+        super().__init__(ConfigParser())
+        self.states = []
+
+    def _join(self, key, cached):
+        state = super()._join(key, cached)
+        self.states.append(state[0])
+        return state
+
+    def wait_for(self, state, count):
+        deadline = time.monotonic() + 10
+        while self.states.count(state) < count:
+            if time.monotonic() > deadline:
+                raise AssertionError('{0} callers are not {1}'.format(count, state))
+            time.sleep(0.01)
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def call_together(self, flights, function, callers=5):
+        # The first caller leads, the others join its fetch before it returns
+        outcomes = [None] * callers
+        release = threading.Event()
+
+        def fetch():
+            release.wait(10)
+            return function()
+
+        def call(idx):
+            try:
+                outcomes[idx] = ('result', flights.do('page', fetch))
+            except Exception as exception:
+                outcomes[idx] = ('error', exception)
+
+        threads = [threading.Thread(target=call, args=(idx,)) for idx in range(callers)]
+        threads[0].start()
+        flights.wait_for('leader', 1)
+        for thread in threads[1:]:
+            thread.start()
+        flights.wait_for('shared', callers - 1)
+        release.set()
+        for thread in threads:
+            thread.join()
+        return outcomes
+
+    def test_callers_share_one_fetch(self):
+        flights = RecordingFlight()
+        calls = []
+        outcomes = self.call_together(flights, lambda: calls.append(1) or {'fields': ['value']})
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(outcomes, [('result', {'fields': ['value']})] * 5)
+        self.assertEqual(flights.do('page', lambda: calls.append(1)), {'fields': ['value']})
+        self.assertEqual(flights.states[-1], 'hit')
+
+    def test_error_reaches_all_waiters(self):
+        flights = RecordingFlight()
+
+        def fail():
+            raise ValueError('FPDS is down')
+
+        outcomes = self.call_together(flights, fail)
+        self.assertEqual([kind for kind, value in outcomes], ['error'] * 5)
+        self.assertEqual({str(value) for kind, value in outcomes}, {'FPDS is down'})
+        self.assertEqual(flights.do('page', lambda: 'fetched again'), 'fetched again')  # errors are not kept
+
+    def test_cancelled_leader_leaves_the_fetch_to_a_waiter(self):
+        flights = RecordingFlight()
+
+        async def run():
+            started = asyncio.Event()
+
+            async def slow():
+                started.set()
+                await asyncio.sleep(10)
+
+            async def fetch():
+                return 'fetched by the waiter'
+
+            leader = asyncio.ensure_future(flights.do_async('page', slow))
+            await started.wait()
+            waiter = asyncio.ensure_future(flights.do_async('page', fetch))
+            while 'shared' not in flights.states:
+                await asyncio.sleep(0.01)
+            leader.cancel()
+            self.assertEqual(await waiter, 'fetched by the waiter')
+            with self.assertRaises(asyncio.CancelledError):
+                await leader
+
+        asyncio.run(run())
+        self.assertEqual(flights.states, ['leader', 'shared', 'leader'])
+        self.assertEqual(flights.do('page', lambda: 'not called'), 'fetched by the waiter')
+
+
+if __name__ == '__main__':
+    unittest.main()
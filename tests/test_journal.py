@@ -0,0 +1,113 @@
+import logging
+import os
+import sys
+import tempfile
+import unittest
+from urllib.parse import parse_qs, urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from fakes import FakeFpds
+from source.emails import Mail
+from source.journal import Journal
+from source.scrapping import Scrapper
+from source.tools import get_output_map, read_config
+
+logger = logging.getLogger(__name__)
+
+
+def read_settings():
+    cwd = os.getcwd()
+    os.chdir(ROOT)  # settings/ paths are relative
+    try:
+        config = read_config(logger)
+    finally:
+        os.chdir(cwd)
+    for path_key in ('mapping', 'atom_mapping'):
+        config.set('path', path_key, os.path.join(ROOT, config.get('path', path_key)))
+    return config
+
+
+class BrokenFormFpds(FakeFpds):
+    # One award form comes back empty: its parse fails the run, like a crash in the middle of it
+
+    def __init__(self, broken, **kwargs):
+        super().__init__(**kwargs)
+        self.broken = broken
+
+    def handle(self, request):
+        query = parse_qs(urlsplit(request.path).query)
+        if self.broken is not None and (query.get('PIID', [''])[0], query.get('modNumber', [''])[0]) == self.broken:
+            self.requests['form'] += 1
+            request.send_response(200)
+            request.send_header('Content-Length', '0')
+            request.end_headers()
+            return
+        super().handle(request)
+
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.TemporaryDirectory()
+        self.config = read_settings()
+        self.config.set('path', 'home_dir', self.work_dir.name)
+
+    def tearDown(self):
+        self.work_dir.cleanup()
+
+    def test_records_are_read_back(self):
+        journal = Journal(self.config, ['b', 'a'], job='letter').open()
+        journal.search('a', True, ['page 1'], ['form 1', 'form 2'])
+        journal.page('page 1', ['form 3'])
+        journal.form('form 1', {'field': 'value'})
+        journal.close(completed=False)
+        with open(journal.path, 'a', encoding='utf-8') as writer:
+            writer.write('{"type": "form", "href": "form 2", "fie')  # cut by a crash
+        journal = Journal(self.config, ['a', 'b'], job='letter').open()
+        try:
+            self.assertEqual(journal.searches, {'a': (True, ['page 1'], ['form 1', 'form 2'])})
+            self.assertEqual(journal.forms, {'form 1': {'field': 'value'}})
+            self.assertEqual(journal.pending_pages(), [])
+            self.assertEqual(journal.pending_forms(), ['form 2', 'form 3'])
+            journal.form('form 2', {'field': 'other'})
+        finally:
+            journal.close(completed=False)
+        journal = Journal(self.config, ['a', 'b'], job='letter').open()
+        self.assertEqual(set(journal.forms), {'form 1', 'form 2'})
+        self.assertNotEqual(Journal(self.config, ['a', 'b'], job='other letter').path, journal.path)
+        journal.close(completed=True)
+        self.assertFalse(os.path.exists(journal.path))
+
+    def test_rerun_resumes_the_failed_run(self):
+        self.config.set('settings', 'engine', 'thread')
+        self.config.set('settings', 'form_workers', '1')
+        for section in ('cache', 'flights', 'metrics'):
+            self.config.set(section, 'enabled', 'no')
+        search_names = ['Vendor 1', 'Vendor 2']
+        fpds = BrokenFormFpds(('VENDOR2', '3'), results=5).start()
+        self.config.set('settings', 'search_HREF', fpds.href)
+        message = Mail(self.config, temp_dir=os.path.join(self.work_dir.name, 'job'))
+        try:
+            self.assertRaises(Exception, Scrapper(self.config, get_output_map(self.config, logger)).run,
+                              search_names, message)
+            journal = Journal(self.config, search_names, job=message.temp_dir)
+            self.assertTrue(os.path.isfile(journal.path))  # kept for the rerun
+            journal.open().close(completed=False)
+            self.assertTrue(journal.searches)
+            fpds.broken = None
+            fpds.requests.clear()
+            scrapper = Scrapper(self.config, get_output_map(self.config, logger))
+            scrapper.run(search_names, message)
+        finally:
+            fpds.stop()
+        self.assertEqual(len(scrapper.forms_df), 10)
+        self.assertEqual(fpds.requests['search'], len(set(search_names) - set(journal.searches)))
+        self.assertEqual(fpds.requests['form'], 10 - len(journal.forms))
+        self.assertFalse(os.path.exists(journal.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import logging
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from source.extractor import FormExtractor
+from source.parsers import ParserPool
+from source.tools import get_output_map, read_config
+
+logger = logging.getLogger(__name__)
+
+
+class ParserPoolTest(unittest.TestCase):
+
+    def test_bad_page_fails_only_its_own_future(self):
+        cwd = os.getcwd()
+        os.chdir(ROOT)  # settings/ paths are relative
+        try:
+            config = read_config(logger)
+            form_tags = {value[0]: value[1] for value in get_output_map(config, logger).values() if value[0]}
+            with open(os.path.join(ROOT, 'benchmarks', 'fixtures', 'fpds_award_form.html'),
+                      encoding='utf-8') as reader:
+                page = reader.read()
+        finally:
+            os.chdir(cwd)
+        config.set('parsers', 'workers', '1')
+        config.set('parsers', 'batch_wait', '0.5')  # the seven pages go in one batch
+        pool = ParserPool(config, form_tags).open()
+        try:
+            futures = [pool.submit(page) for page in [page] * 3 + [''] + [page] * 3]
+            expected = FormExtractor(form_tags).extract(page)
+            self.assertRaisesRegex(Exception, 'ParserError', futures[3].result)
+            for future in futures[:3] + futures[4:]:
+                self.assertEqual(future.result(), expected)
+        finally:
+            pool.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import logging
+import os
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from fakes import FakeFpds
+from source.emails import Mail
+from source.scrapping import Scrapper
+from source.tools import get_output_map, read_config
+
+logger = logging.getLogger(__name__)
+
+
+def read_settings():
+    cwd = os.getcwd()
+    os.chdir(ROOT)  # settings/ paths are relative
+    try:
+        config = read_config(logger)
+    finally:
+        os.chdir(cwd)
+    for path_key in ('mapping', 'atom_mapping'):
+        config.set('path', path_key, os.path.join(ROOT, config.get('path', path_key)))
+    return config
+
+
+class EngineParityTest(unittest.TestCase):
+
+    def scrape(self, fpds, engine, search_names):
+        with tempfile.TemporaryDirectory() as work_dir:
+            config = read_settings()
+            config.set('path', 'home_dir', work_dir)
+            config.set('settings', 'search_HREF', fpds.href)
+            config.set('settings', 'engine', engine)
+            for section in ('cache', 'flights', 'journal', 'metrics'):
+                config.set(section, 'enabled', 'no')
+            scrapper = Scrapper(config, get_output_map(config, logger))
+            scrapper.run(search_names, Mail(config, temp_dir=os.path.join(work_dir, 'job')))
+            return sorted(tuple(str(value) for value in row) for row in scrapper.forms_df.itertuples(index=False))
+
+    def test_invalid_byte_in_a_utf8_page(self):
+        fpds = FakeFpds(results=3).start()
+        fpds.form_page = fpds.form_page.replace(b'</body>', b'\xe9</body>', 1)  # served as charset=UTF-8
+        try:
+            rows = {engine: self.scrape(fpds, engine, ['Vendor 1', 'Vendor 2']) for engine in ('thread', 'asyncio')}
+        finally:
+            fpds.stop()
+        self.assertEqual(len(rows['thread']), 6)
+        self.assertEqual(rows['asyncio'], rows['thread'])
+
+
+if __name__ == '__main__':
+    unittest.main()
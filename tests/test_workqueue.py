@@ -0,0 +1,48 @@
+import logging
+import os
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from source.tools import read_config
+from source.workqueue import SqliteWorkQueue
+
+logger = logging.getLogger(__name__)
+
+
+class SqliteWorkQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        cwd = os.getcwd()
+        os.chdir(ROOT)  # settings/ paths are relative
+        try:
+            self.config = read_config(logger)
+        finally:
+            os.chdir(cwd)
+        self.work_dir = tempfile.TemporaryDirectory()
+        self.config.set('path', 'work_queue', os.path.join(self.work_dir.name, 'work.sqlite'))
+        self.config.set('queue', 'lease_seconds', '0')  # every lease is expired at once
+        self.queue = SqliteWorkQueue(self.config).open()
+
+    def tearDown(self):
+        self.queue.close()
+        self.work_dir.cleanup()
+
+    def test_expired_lease_belongs_to_the_new_worker(self):
+        run = self.queue.new_run()
+        self.queue.publish(run, 'form', ['href'])
+        (item_id, leased_run, kind, item), = self.queue.lease('first')
+        self.assertEqual((leased_run, kind, item), (run, 'form', 'href'))
+        self.assertEqual(self.queue.lease('second'), [(item_id, run, 'form', 'href')])
+        self.queue.complete(item_id, 'first', {'fields': 'late'})
+        self.queue.fail(item_id, 'first', 'late error')
+        self.assertEqual(self.queue.collect(run), [])
+        self.queue.complete(item_id, 'second', {'fields': 'done'})
+        self.assertEqual(self.queue.collect(run), [('form', 'href', {'fields': 'done'}, None)])
+
+
+if __name__ == '__main__':
+    unittest.main()
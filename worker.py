@@ -0,0 +1,89 @@
+import logging.config
+import os
+import signal
+import socket
+import threading
+import time
+
+from source.metrics import metrics
+from source.tools import get_output_map, make_loger, read_config
+from source.workqueue import make_work_queue
+
+logger = logging.getLogger('workerFPDS')
+
+
+class Worker:
+    # Stateless scrapping worker ([queue] in settings/config.cfg): leases work items of any run from the shared
+    # queue, fetches and parses them and writes the results back. Any number may run on one or several nodes,
+    # a worker which is stopped or dies leaves its leased items to the others
+
+    def __init__(self, config):
+        self.config = config
+        self.name = '{0}:{1}'.format(socket.gethostname(), os.getpid())
+        self.threads = config.getint('queue', 'worker_threads', fallback=10)
+        self.poll_interval = config.getfloat('queue', 'poll_interval', fallback=0.5)
+        self.idle_exit = config.getfloat('queue', 'worker_idle_exit', fallback=0)
+        self.stopping = threading.Event()
+        self.done = 0
+        self._queue = make_work_queue(config)
+        self._scrapper = None
+        self._active = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _idle(self):
+        with self._lock:
+            idle = time.monotonic() - self._active
+        if idle > self.poll_interval:
+            self._scrapper.idle()
+        if self.idle_exit and idle > self.idle_exit:
+            self.stopping.set()
+        self.stopping.wait(self.poll_interval)
+
+    def _work(self):
+        while not self.stopping.is_set():
+            items = self._queue.lease(self.name)
+            if not items:
+                self._idle()
+                continue
+            for item_id, run, kind, item in items:
+                try:
+                    result = self._scrapper.work(kind, item, run)
+                except Exception as exception:
+                    logger.error(self.config.get('error', 'work_item_failed').format(kind, item, exception),
+                                 exc_info=True)
+                    self._queue.fail(item_id, self.name, repr(exception))
+                else:
+                    self._queue.complete(item_id, self.name, result)
+                with self._lock:
+                    self._active = time.monotonic()
+                    self.done += 1
+
+    def run(self):
+        from source.scrapping import Scrapper
+        self._queue.open()
+        self._scrapper = Scrapper(self.config, get_output_map(self.config, logger)).open_worker()
+        logger.info(self.config.get('info', 'worker_started').format(self.name, self.threads))
+        threads = [threading.Thread(target=self._work, name='worker_{0}'.format(i), daemon=True)
+                   for i in range(self.threads)]
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            self._scrapper.close_worker()
+            self._queue.close()
+            logger.info(self.config.get('info', 'worker_stopped').format(self.name, self.done))
+
+
+if __name__ == "__main__":
+    make_loger()
+    try:
+        worker = Worker(read_config(logger))
+        for signal_number in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signal_number, lambda signum, frame: worker.stopping.set())
+        metrics.configure(worker.config)
+        worker.run()
+        metrics.write()
+    except Exception:
+        logger.error('FPDS worker failed.', exc_info=True)